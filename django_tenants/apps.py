@@ -1,5 +1,5 @@
 from django.conf import settings
-from django.apps import AppConfig
+from django.apps import AppConfig, apps as django_apps
 from django.core.exceptions import ImproperlyConfigured
 from django_tenants.utils import get_public_schema_name, get_tenant_model
 
@@ -18,6 +18,10 @@ class DjangoTenantsConfig(AppConfig):
 
     def ready(self):
         from django.db import connection
+        from django.db.models.signals import post_save, post_delete
+        from django_tenants.contenttypes import install_content_type_cache, clear_schema_content_types
+        from django_tenants.middleware.cache import invalidate_tenant_cache, connect_user_relation_signals
+        from django_tenants.signals import post_schema_sync
 
         # Test for configuration recommendations. These are best practices,
         # they avoid hard to find bugs and unexpected behaviour.
@@ -31,6 +35,34 @@ class DjangoTenantsConfig(AppConfig):
         if not hasattr(settings, 'TENANT_MODEL'):
             raise ImproperlyConfigured('TENANT_MODEL setting not set')
 
+        # Cached tenants are stale as soon as a tenant changes
+        post_save.connect(invalidate_tenant_cache, sender=settings.TENANT_MODEL,
+                          dispatch_uid='django_tenants.invalidate_tenant_cache')
+        post_delete.connect(invalidate_tenant_cache, sender=settings.TENANT_MODEL,
+                            dispatch_uid='django_tenants.invalidate_tenant_cache')
+        if django_apps.is_installed('django.contrib.auth'):
+            from django.contrib.auth import get_user_model
+
+            connect_user_relation_signals(get_user_model(), get_tenant_model())
+
+        if hasattr(settings, 'TENANT_DOMAIN_MODEL'):
+            from django_tenants.middleware.domain import domain_index_post_save, domain_index_post_delete
+
+            for sender in (settings.TENANT_MODEL, settings.TENANT_DOMAIN_MODEL):
+                post_save.connect(domain_index_post_save, sender=sender,
+                                  dispatch_uid='django_tenants.domain_index_post_save')
+                post_delete.connect(domain_index_post_delete, sender=sender,
+                                    dispatch_uid='django_tenants.domain_index_post_delete')
+
+        # Content types are cached per schema, so the cache survives requests
+        # without mixing up ids of different schemas
+        if django_apps.is_installed('django.contrib.contenttypes'):
+            install_content_type_cache()
+            post_schema_sync.connect(clear_schema_content_types,
+                                     dispatch_uid='django_tenants.clear_schema_content_types')
+            post_delete.connect(clear_schema_content_types, sender=settings.TENANT_MODEL,
+                                dispatch_uid='django_tenants.clear_schema_content_types')
+
         if 'django_tenants.routers.TenantSyncRouter' not in settings.DATABASE_ROUTERS:
             raise ImproperlyConfigured("DATABASE_ROUTERS setting must contain "
                                        "'django_tenants.routers.TenantSyncRouter'.")
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+from django.db import connections
+
+from django_tenants.utils import get_content_type_cache_size
+
+
+class SchemaPartitionedCache(object):
+    """
+    Replacement for the ``_cache`` dict of ContentTypeManager, that keeps a
+    separate cache per database alias and schema. Content types of the public
+    schema and of each tenant schema can have different ids, so they must not
+    be shared, but each of them can be cached across requests.
+
+    ContentTypeManager only uses ``cache[using]``, ``cache.setdefault(using, {})``
+    and ``cache.clear()``, which are resolved against the schema currently
+    active on the ``using`` connection. Only the ``max_size`` most recently
+    used schemas are kept.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._partitions = OrderedDict()
+
+    def _get_key(self, using):
+        return using, getattr(connections[using], 'schema_name', None)
+
+    def __getitem__(self, using):
+        key = self._get_key(using)
+        with self._lock:
+            partition = self._partitions[key]
+            self._partitions.move_to_end(key)
+            return partition
+
+    def __contains__(self, using):
+        return self._get_key(using) in self._partitions
+
+    def get(self, using, default=None):
+        try:
+            return self[using]
+        except KeyError:
+            return default
+
+    def setdefault(self, using, default=None):
+        key = self._get_key(using)
+        with self._lock:
+            partition = self._partitions.setdefault(key, default)
+            self._partitions.move_to_end(key)
+            while len(self._partitions) > self.max_size:
+                self._partitions.popitem(last=False)
+            return partition
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+    def clear_schema(self, schema_name):
+        """
+        Forgets the content types of a schema, for instance because it was
+        dropped and could be created again with different ids.
+        """
+        with self._lock:
+            for key in list(self._partitions):
+                if key[1] == schema_name:
+                    del self._partitions[key]
+
+
+def install_content_type_cache():
+    from django.contrib.contenttypes.models import ContentType, ContentTypeManager
+
+    # ContentType.objects is a copy of the manager declared on the model,
+    # made again whenever the model options are expired, so the cache goes on
+    # the declared manager and is shared by all of its copies.
+    cache = SchemaPartitionedCache(get_content_type_cache_size())
+    for manager in ContentType._meta.local_managers + [ContentType.objects]:
+        if isinstance(manager, ContentTypeManager) and not isinstance(manager._cache, SchemaPartitionedCache):
+            manager._cache = cache
+
+
+def clear_schema_content_types(sender, tenant=None, instance=None, **kwargs):
+    """
+    Receiver for post_schema_sync and post_delete of the tenant model.
+    """
+    from django.contrib.contenttypes.models import ContentType
+
+    tenant = tenant or instance
+    cache = ContentType.objects._cache
+    if tenant is not None and isinstance(cache, SchemaPartitionedCache):
+        cache.clear_schema(tenant.schema_name)
@@ -132,7 +132,8 @@ class SyncCommon(BaseCommand):
                             help='Tells Django to populate only shared applications.')
         parser.add_argument("-s", "--schema", dest="schema_name")
         parser.add_argument('--executor', action='store', dest='executor', default=None,
-                            help='Executor to be used for running migrations [standard|multiprocessing]')
+                            help='Executor to be used for running migrations '
+                                 '[standard|multiprocessing|threaded|replay]')
 
     def handle(self, *args, **options):
         self.sync_tenant = options.get('tenant')
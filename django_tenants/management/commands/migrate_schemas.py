@@ -1,5 +1,11 @@
+from django.db import connections
+
 from django_tenants.migration_executors import get_executor
-from django_tenants.utils import get_tenant_model, get_public_schema_name, schema_exists, get_tenant_database_alias
+from django_tenants.migration_executors.base import get_leaf_migrations, get_schemas_to_migrate
+from django_tenants.migration_executors.journal import MigrationJournal, get_plan_hash
+from django_tenants.migration_executors.loader import cached_migrations
+from django_tenants.utils import get_tenant_model, get_public_schema_name, schema_exists, get_tenant_database_alias, \
+    get_migration_journal_path
 from django_tenants.management.commands import SyncCommon
 from django_tenants.signals import post_schema_migrate
 from django_tenants.models import TenantMixin
@@ -34,6 +40,12 @@ class MigrateSchemasCommand(SyncCommon):
                             help='Show a list of all known migrations and which are applied')
         parser.add_argument('--run-syncdb', action='store_true', dest='run_syncdb',
                             help='Creates tables for apps without migrations.')
+        parser.add_argument('--no-skip-current', action='store_false', dest='skip_current', default=True,
+                            help='Run migrate on every tenant schema, even those where all the migrations are '
+                                 'already applied.')
+        parser.add_argument('--resume', action='store_true', dest='resume', default=False,
+                            help='Skip the tenant schemas already migrated by an interrupted run of the same '
+                                 'migrations.')
 
     def handle(self, *args, **options):
         super(MigrateSchemasCommand, self).handle(*args, **options)
@@ -44,6 +56,11 @@ class MigrateSchemasCommand(SyncCommon):
 
         executor = get_executor(codename=self.executor)(self.args, self.options)
 
+        # the migration files are read and the graph built once for all schemas
+        with cached_migrations():
+            self.run_migrations(executor)
+
+    def run_migrations(self, executor):
         if self.sync_public:
             executor.run_migrations(tenants=[self.PUBLIC_SCHEMA_NAME])
         if self.sync_tenant:
@@ -59,7 +76,31 @@ class MigrateSchemasCommand(SyncCommon):
                     schema_name=self.PUBLIC_SCHEMA_NAME).values_list(
                     'schema_name', flat=True)
 
-            executor.run_migrations(tenants=tenants)
+            tenants = list(tenants)
+            tenants_to_migrate = tenants
+            journal = self.get_journal()
+            if journal is not None:
+                if self.options.get('resume'):
+                    completed = journal.get_completed()
+                    tenants_to_migrate = [schema_name for schema_name in tenants_to_migrate
+                                          if schema_name not in completed]
+                    if int(self.options.get('verbosity', 1)) >= 1:
+                        self._notice('Resuming, skipping %d of %d tenant schemas already migrated'
+                                     % (len(tenants) - len(tenants_to_migrate), len(tenants)))
+                else:
+                    journal.truncate()
+
+            if self.can_skip_current_schemas():
+                count = len(tenants_to_migrate)
+                tenants_to_migrate = get_schemas_to_migrate(tenants_to_migrate,
+                                                            database=self.options.get('database'))
+                if int(self.options.get('verbosity', 1)) >= 1:
+                    self._notice('Skipping %d of %d tenant schemas with no pending migrations'
+                                 % (count - len(tenants_to_migrate), count))
+
+            # the executors record every migrated schema in the journal
+            executor.options['migration_journal'] = journal
+            executor.run_migrations(tenants=tenants_to_migrate)
             tenant_objects = get_tenant_model().objects.filter(schema_name__in=tenants)
 
             for tenant in tenant_objects:
@@ -67,5 +108,26 @@ class MigrateSchemasCommand(SyncCommon):
                     continue
                 post_schema_migrate.send(sender=TenantMixin, tenant=tenant.serializable_fields())
 
+    def get_journal(self):
+        """
+        The journal is only kept when migrating all the tenants, so migrating
+        a single schema, e.g. when creating a tenant, does not reset it.
+        """
+        if (self.schema_name and self.schema_name != self.PUBLIC_SCHEMA_NAME) or self.options.get('list'):
+            return None
+        database = self.options.get('database')
+        return MigrationJournal(get_migration_journal_path(database),
+                                get_plan_hash(get_leaf_migrations(), self.options, connections[database].settings_dict))
+
+    def can_skip_current_schemas(self):
+        """
+        Schemas with all the migrations applied are only skipped when
+        migrating everything, not when targeting or listing migrations.
+        """
+        options = self.options
+        return (options.get('skip_current', True) and not options.get('app_label') and
+                not options.get('migration_name') and not options.get('list') and
+                not options.get('run_syncdb'))
+
 
 Command = MigrateSchemasCommand
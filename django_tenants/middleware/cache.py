@@ -0,0 +1,237 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from django_tenants.utils import get_tenant_cache_timeout, get_tenant_cache_size, get_tenant_cache_alias, \
+    get_fallback_tenant_cache_timeout
+
+
+TENANT_VERSION_KEY = 'django_tenants:tenant_version'
+
+logger = logging.getLogger('django_tenants.cache')
+
+_missing = object()
+
+
+def get_tenant_version(alias=None):
+    """
+    Returns a number, stored in the Django cache, that changes every time a
+    tenant is saved or deleted. Returns None if the cache doesn't keep it,
+    like the DummyCache.
+    """
+    cache = caches[alias or get_tenant_cache_alias() or DEFAULT_CACHE_ALIAS]
+    version = cache.get(TENANT_VERSION_KEY)
+    if version is None:
+        # never start from a version an evicted key may have had before
+        cache.add(TENANT_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(TENANT_VERSION_KEY)
+    return version
+
+
+def is_tenant_version_shared(alias=None):
+    """
+    Tells if the tenant version is seen by all the processes, that is if it
+    is not kept in a cache of this process only.
+    """
+    cache = caches[alias or get_tenant_cache_alias() or DEFAULT_CACHE_ALIAS]
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def bump_tenant_version(alias=None, fail_silently=False):
+    """
+    Changes the tenant version. With ``fail_silently`` errors of the cache
+    are logged instead of raised.
+    """
+    cache = caches[alias or get_tenant_cache_alias() or DEFAULT_CACHE_ALIAS]
+    try:
+        try:
+            cache.incr(TENANT_VERSION_KEY)
+        except ValueError:
+            cache.set(TENANT_VERSION_KEY, int(time.time() * 1000), None)
+    except Exception:
+        if not fail_silently:
+            raise
+        logger.exception('Could not change the tenant version')
+
+
+class TenantCache(object):
+    """
+    Process wide LRU cache of resolved tenants, whose entries expire after
+    ``timeout`` seconds. When ``alias`` is given, the Django cache with that
+    alias is used as a second level shared by all processes, and an
+    invalidation reaches all of them through get_tenant_version().
+    """
+    key_prefix = 'django_tenants:tenant'
+
+    def __init__(self, timeout, max_size, alias=None):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._local_version = 0
+
+    def _get_shared_version(self):
+        if self.alias is None:
+            return None
+        return get_tenant_version(self.alias)
+
+    def _make_key(self, key, shared_version):
+        return '%s:%s:%s' % (self.key_prefix, shared_version, key)
+
+    def _store(self, key, tenant, version, expires):
+        with self._lock:
+            self._entries[key] = (tenant, version, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, load):
+        """
+        Returns a copy of the cached tenant for ``key``, calling ``load()`` to
+        resolve it on a miss. ``load()`` may return None, which is cached as
+        well, but exceptions it raises are not.
+        """
+        shared_version = self._get_shared_version()
+        now = time.time()
+        with self._lock:
+            # taken before loading, so a tenant invalidated while it was
+            # being loaded is never served from the cache
+            version = (self._local_version, shared_version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                tenant, entry_version, expires = entry
+                if entry_version == version and expires > now:
+                    self._entries.move_to_end(key)
+                    return copy.deepcopy(tenant)
+                del self._entries[key]
+
+        tenant = _missing
+        if self.alias is not None:
+            tenant = caches[self.alias].get(self._make_key(key, shared_version), _missing)
+        if tenant is _missing:
+            tenant = load()
+            if self.alias is not None:
+                caches[self.alias].set(self._make_key(key, shared_version), tenant, self.timeout)
+        self._store(key, copy.deepcopy(tenant), version, now + self.timeout)
+        return tenant
+
+    def invalidate(self):
+        """
+        Clears the cache of this process, bump_tenant_version() clears it
+        for all of them.
+        """
+        with self._lock:
+            self._local_version += 1
+            self._entries.clear()
+
+
+_tenant_caches = {}
+_tenant_caches_lock = threading.Lock()
+
+
+def _get_named_cache(name, timeout, max_size):
+    if not timeout:
+        return None
+    config = (timeout, max_size, get_tenant_cache_alias())
+    tenant_cache = _tenant_caches.get(name)
+    if tenant_cache is None or (tenant_cache.timeout, tenant_cache.max_size, tenant_cache.alias) != config:
+        with _tenant_caches_lock:
+            tenant_cache = _tenant_caches.get(name)
+            if tenant_cache is None or (tenant_cache.timeout, tenant_cache.max_size,
+                                        tenant_cache.alias) != config:
+                tenant_cache = _tenant_caches[name] = TenantCache(*config)
+    return tenant_cache
+
+
+def get_tenant_cache():
+    """
+    Returns the process wide cache of the tenant of each user, or None if
+    TENANT_USER_CACHE_TIMEOUT is not set.
+    """
+    return _get_named_cache('user', get_tenant_cache_timeout(), get_tenant_cache_size())
+
+
+def get_fallback_tenant(tenant_model, schema_name):
+    """
+    Returns the tenant served when none was found for the request. It is
+    only loaded again after a tenant changed or TENANT_FALLBACK_CACHE_TIMEOUT
+    seconds.
+    """
+    def load():
+        return tenant_model.objects.get(schema_name=schema_name)
+
+    tenant_cache = _get_named_cache('fallback', get_fallback_tenant_cache_timeout(), 16)
+    if tenant_cache is None:
+        return load()
+    return tenant_cache.get_or_load('fallback:%s' % schema_name, load)
+
+
+def invalidate_tenant_cache(sender=None, **kwargs):
+    """
+    Receiver for post_save and post_delete of the tenant model. Also
+    invalidates the tenant hints of TenantMainMiddleware. Call it after
+    changing which tenant a user belongs to in a way the signals don't see,
+    for instance with QuerySet.update().
+    """
+    for tenant_cache in list(_tenant_caches.values()):
+        tenant_cache.invalidate()
+    # saving a tenant must not depend on the cache being reachable
+    bump_tenant_version(fail_silently=True)
+
+
+def get_user_tenant_fields(user_model, tenant_model):
+    """
+    Returns the names of the foreign keys of the user model to the tenant
+    model.
+    """
+    return {field.name for field in user_model._meta.concrete_fields
+            if field.is_relation and field.related_model is tenant_model}
+
+
+def invalidate_tenant_cache_m2m(sender=None, action=None, **kwargs):
+    """
+    Receiver for m2m_changed of many to many relations between users and
+    tenants.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_tenant_cache()
+
+
+def invalidate_tenant_cache_user(sender=None, created=False, update_fields=None, **kwargs):
+    """
+    Receiver for post_save of a user model with a foreign key to the tenant
+    model. Saves only updating other fields, such as the last_login
+    update of every login, keep the cache.
+    """
+    from django_tenants.utils import get_tenant_model
+
+    if created:
+        return
+    if update_fields is not None and not get_user_tenant_fields(sender, get_tenant_model()) & set(update_fields):
+        return
+    invalidate_tenant_cache()
+
+
+def connect_user_relation_signals(user_model, tenant_model):
+    """
+    Invalidates the cached tenants and hints when the tenant of a user
+    changes through a foreign key on the user model or a many to many
+    relation between both models.
+    """
+    from django.db.models.signals import m2m_changed, post_save
+
+    if get_user_tenant_fields(user_model, tenant_model):
+        post_save.connect(invalidate_tenant_cache_user, sender=user_model,
+                          dispatch_uid='django_tenants.invalidate_tenant_cache_user')
+    for field in tenant_model._meta.get_fields(include_hidden=True):
+        if field.many_to_many and field.related_model is user_model:
+            through = field.remote_field.through if field.concrete else field.through
+            m2m_changed.connect(invalidate_tenant_cache_m2m, sender=through,
+                                dispatch_uid='django_tenants.invalidate_tenant_cache_m2m.%s' % through._meta.label)
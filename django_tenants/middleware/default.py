@@ -1,3 +1,4 @@
+from django_tenants.middleware.cache import get_fallback_tenant
 from django_tenants.middleware.suspicious import SuspiciousTenantMiddleware
 from django_tenants.utils import get_public_schema_name, get_tenant_model
 from django.http import Http404
@@ -19,12 +20,11 @@ class DefaultTenantMiddleware(SuspiciousTenantMiddleware):
     def get_tenant(self, tenant_model, user):
         try:
             return super(DefaultTenantMiddleware, self).get_tenant(tenant_model, user)
-        except self.TENANT_NOT_FOUND_EXCEPTION or self.NO_TENANT_EXCEPTION:
+        except (self.TENANT_NOT_FOUND_EXCEPTION, self.NO_TENANT_EXCEPTION):
             schema_name = self.DEFAULT_SCHEMA_NAME
             if not schema_name:
                 schema_name = get_public_schema_name()
-            tenant_model = get_tenant_model()
-            return tenant_model.objects.get(schema_name=schema_name)
+            return get_fallback_tenant(get_tenant_model(), schema_name)
         except Exception as e:
             print(e)
             print(e.message)
@@ -0,0 +1,220 @@
+import copy
+import threading
+import time
+
+from django.http.request import split_domain_port
+
+from django_tenants.middleware.cache import bump_tenant_version, get_tenant_version
+from django_tenants.middleware.main import TenantMainMiddleware
+from django_tenants.utils import get_tenant_domain_model, get_tenant_database_alias, get_domain_index_timeout, \
+    get_domain_index_check_interval, remove_www
+
+WILDCARD_PREFIX = '*.'
+
+
+class _Node(object):
+    __slots__ = ('children', 'tenant_pk')
+
+    def __init__(self):
+        self.children = {}
+        # tenant of the "*." domain ending at this node
+        self.tenant_pk = None
+
+
+class DomainIndex(object):
+    """
+    In-memory index of all the tenant domains, so resolving a hostname does
+    not need a query. Exact domains are kept in a dict, wildcard domains
+    (``*.example.com``, matching any subdomain) in a trie of the reversed
+    labels where the most specific one wins.
+
+    The index is loaded on first use and kept up to date by the signals of
+    the domain and tenant models in this process. They also change the
+    tenant version, checked at most every TENANT_DOMAIN_INDEX_CHECK_INTERVAL
+    seconds, so the other processes load their index again. Without a
+    version, for instance with the DummyCache, they only do so after
+    TENANT_DOMAIN_INDEX_TIMEOUT seconds.
+
+    The lock only guards the in-memory structures, the cache and the
+    database are never waited on while holding it.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # only one thread loads the index at a time
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        self._checked_at = None
+        self._version = None
+        self._exact = {}
+        self._wildcards = _Node()
+        self._tenants = {}
+        self._domains = {}
+
+    def _is_loaded(self):
+        if self._loaded_at is None:
+            return False
+        now = time.time()
+        timeout = get_domain_index_timeout()
+        if timeout and now - self._loaded_at >= timeout:
+            return False
+        if now - self._checked_at < get_domain_index_check_interval():
+            return True
+        self._checked_at = now
+        version = self._get_version()
+        return version is None or version == self._version
+
+    @staticmethod
+    def _get_version():
+        try:
+            return get_tenant_version()
+        except Exception:
+            # fall back to the timeout when the cache can't be reached
+            return None
+
+    def load(self):
+        # read before the query, so a change made meanwhile reloads again
+        version = self._get_version()
+        domains = get_tenant_domain_model().objects.using(get_tenant_database_alias()).select_related('tenant')
+        index = DomainIndex()
+        for domain in domains:
+            index._add(domain.pk, domain.domain, domain.tenant)
+        with self._lock:
+            self._exact = index._exact
+            self._wildcards = index._wildcards
+            self._tenants = index._tenants
+            self._domains = index._domains
+            self._loaded_at = self._checked_at = time.time()
+            self._version = version
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+
+    @staticmethod
+    def _labels(domain):
+        return reversed(domain.lower().rstrip('.').split('.'))
+
+    def _add(self, domain_pk, domain, tenant):
+        self._domains[domain_pk] = (domain, tenant.pk)
+        self._tenants[tenant.pk] = tenant
+        if domain.startswith(WILDCARD_PREFIX):
+            node = self._wildcards
+            for label in self._labels(domain[len(WILDCARD_PREFIX):]):
+                node = node.children.setdefault(label, _Node())
+            node.tenant_pk = tenant.pk
+        else:
+            self._exact[domain.lower().rstrip('.')] = tenant.pk
+
+    def _remove(self, domain_pk):
+        domain, tenant_pk = self._domains.pop(domain_pk, (None, None))
+        if domain is None:
+            return
+        if domain.startswith(WILDCARD_PREFIX):
+            node = self._wildcards
+            for label in self._labels(domain[len(WILDCARD_PREFIX):]):
+                node = node.children.get(label)
+                if node is None:
+                    break
+            else:
+                node.tenant_pk = None
+        else:
+            self._exact.pop(domain.lower().rstrip('.'), None)
+        if not any(pk == tenant_pk for _, pk in self._domains.values()):
+            self._tenants.pop(tenant_pk, None)
+
+    def _find(self, hostname):
+        hostname = hostname.lower().rstrip('.')
+        tenant_pk = self._exact.get(hostname)
+        if tenant_pk is not None:
+            return tenant_pk
+        labels = hostname.split('.')
+        node = self._wildcards
+        # a wildcard needs at least one label in front of it
+        for label in reversed(labels[1:]):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.tenant_pk is not None:
+                tenant_pk = node.tenant_pk
+        return tenant_pk
+
+    def get_tenant(self, hostname):
+        """
+        Returns a copy of the tenant serving ``hostname``, or None.
+        """
+        loaded_at = self._loaded_at
+        if not self._is_loaded():
+            with self._load_lock:
+                # unless another thread loaded it in the meantime
+                if self._loaded_at == loaded_at:
+                    self.load()
+        with self._lock:
+            tenant = self._tenants.get(self._find(hostname))
+        return copy.deepcopy(tenant) if tenant is not None else None
+
+    def domain_saved(self, domain):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._remove(domain.pk)
+                self._add(domain.pk, domain.domain, copy.deepcopy(domain.tenant))
+
+    def domain_deleted(self, domain_pk):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._remove(domain_pk)
+
+    def tenant_saved(self, tenant):
+        with self._lock:
+            if tenant.pk in self._tenants:
+                self._tenants[tenant.pk] = copy.deepcopy(tenant)
+
+    def tenant_deleted(self, tenant_pk):
+        with self._lock:
+            for domain_pk, (_, pk) in list(self._domains.items()):
+                if pk == tenant_pk:
+                    self._remove(domain_pk)
+
+
+domain_index = DomainIndex()
+
+
+def domain_index_post_save(sender, instance, **kwargs):
+    """
+    Receiver for post_save of the domain and tenant models. Tenants change
+    the tenant version in invalidate_tenant_cache().
+    """
+    if sender is get_tenant_domain_model():
+        domain_index.domain_saved(instance)
+        bump_tenant_version(fail_silently=True)
+    else:
+        domain_index.tenant_saved(instance)
+
+
+def domain_index_post_delete(sender, instance, **kwargs):
+    """
+    Receiver for post_delete of the domain and tenant models.
+    """
+    if sender is get_tenant_domain_model():
+        domain_index.domain_deleted(instance.pk)
+        bump_tenant_version(fail_silently=True)
+    else:
+        domain_index.tenant_deleted(instance.pk)
+
+
+class TenantDomainMiddleware(TenantMainMiddleware):
+    """
+    Selects the tenant from the hostname of the request, using the in-memory
+    domain index instead of a query per request.
+    """
+
+    def hostname_from_request(self, request):
+        domain, port = split_domain_port(request.get_host())
+        return remove_www(domain)
+
+    def resolve_tenant(self, request):
+        hostname = self.hostname_from_request(request)
+        tenant = domain_index.get_tenant(hostname)
+        if tenant is None:
+            raise self.TENANT_NOT_FOUND_EXCEPTION('No tenant for hostname "{}"'.format(hostname))
+        return tenant
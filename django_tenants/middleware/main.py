@@ -1,12 +1,16 @@
+import json
+
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.db import connection
 from django.http import Http404
 
 
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
 
-from django_tenants.utils import get_public_schema_name, get_tenant_model
+from django_tenants.middleware.cache import get_tenant_cache, get_tenant_version, is_tenant_version_shared
+from django_tenants.utils import get_public_schema_name, get_tenant_model, get_tenant_database_alias
 
 
 class TenantMainMiddleware(MiddlewareMixin):
@@ -16,42 +20,155 @@ class TenantMainMiddleware(MiddlewareMixin):
     Selects the proper database schema using the request host. Can fail in
     various ways which is better than corrupting or revealing data.
     """
+    LAZY_ACTIVATION = False
+    """
+    Set this flag to true on a subclass to only resolve the tenant and switch
+    the schema when ``request.tenant`` is used or the first cursor is opened.
+    """
+    TENANT_HINT = None
+    """
+    Set to 'session' or 'cookie' on a subclass to remember the tenant of the
+    user there after the first lookup, so the next requests resolve it
+    without a query as long as no tenant changed in the meantime.
+    """
+    TENANT_HINT_NAME = 'tenant_hint'
+    TENANT_HINT_SALT = 'django_tenants.middleware.main.TenantMainMiddleware'
+
+    def __init__(self, get_response=None):
+        super(TenantMainMiddleware, self).__init__(get_response)
+        if self.TENANT_HINT and not is_tenant_version_shared():
+            # other processes would never see a hint invalidated
+            raise ImproperlyConfigured('TENANT_HINT requires a cache shared by all processes, set '
+                                       'TENANT_USER_CACHE_ALIAS to one that is not a local memory or dummy cache.')
+
+    def get_user_tenant(self, tenant_model, user):
+        try:
+            return tenant_model.objects.get(user=user)
+        except tenant_model.DoesNotExist:
+            raise self.TENANT_NOT_FOUND_EXCEPTION('User does not have tenant')
 
     def get_tenant(self, tenant_model, user):
         if not user:
             raise self.TENANT_NOT_FOUND_EXCEPTION('No user logged in')
-        if user.is_authenticated() and not user.is_staff:
-            try:
-                return tenant_model.objects.get(user=user)
-            except tenant_model.DoesNotExist:
+        if user.is_authenticated and not user.is_staff:
+            tenant_cache = get_tenant_cache()
+            if tenant_cache is None:
+                return self.get_user_tenant(tenant_model, user)
+
+            def load():
+                try:
+                    return self.get_user_tenant(tenant_model, user)
+                except self.TENANT_NOT_FOUND_EXCEPTION:
+                    # remember users without tenant as well
+                    return None
+
+            tenant = tenant_cache.get_or_load(user.pk, load)
+            if tenant is None:
                 raise self.TENANT_NOT_FOUND_EXCEPTION('User does not have tenant')
+            return tenant
         raise self.TENANT_NOT_FOUND_EXCEPTION('Staff user')
 
-    def process_request(self, request):
-        # Connection needs first to be at the public schema, as this is where
-        # the tenant metadata is stored.
-        connection.set_schema_to_public()
+    def _can_use_tenant_hint(self, user):
+        return self.TENANT_HINT and user and user.is_authenticated and not user.is_staff
+
+    def _load_tenant_hint(self, request):
+        if self.TENANT_HINT == 'cookie':
+            value = request.get_signed_cookie(self.TENANT_HINT_NAME, default=None, salt=self.TENANT_HINT_SALT)
+            try:
+                return json.loads(value) if value else None
+            except ValueError:
+                return None
+        session = getattr(request, 'session', None)
+        return session.get(self.TENANT_HINT_NAME) if session is not None else None
+
+    def get_hinted_tenant(self, request, tenant_model, user, version):
+        """
+        Returns the tenant remembered for this user, with only its primary key
+        and schema_name loaded, or None if there is no valid hint.
+        """
+        hint = self._load_tenant_hint(request)
+        if not isinstance(hint, dict) or version is None:
+            return None
+        if hint.get('user') != str(user.pk) or hint.get('version') != version:
+            return None
+        pk_field = tenant_model._meta.pk
+        try:
+            loaded = {pk_field.attname: pk_field.to_python(hint['pk']), 'schema_name': hint['schema_name']}
+        except (KeyError, ValidationError):
+            return None
+        # from_db() expects the fields in the order of the model
+        field_names = [field.attname for field in tenant_model._meta.concrete_fields if field.attname in loaded]
+        return tenant_model.from_db(get_tenant_database_alias(), field_names,
+                                    [loaded[field_name] for field_name in field_names])
+
+    def store_tenant_hint(self, request, tenant, user, version):
+        hint = {
+            'pk': tenant._meta.pk.value_to_string(tenant),
+            'schema_name': tenant.schema_name,
+            'user': str(user.pk),
+            'version': version,
+        }
+        if self.TENANT_HINT == 'cookie':
+            # set in process_response
+            request._tenant_hint = hint
+        elif getattr(request, 'session', None) is not None:
+            request.session[self.TENANT_HINT_NAME] = hint
+
+    def resolve_tenant(self, request):
         tenant_model = get_tenant_model()
         user = getattr(request, 'user', None)
 
+        use_hint = self._can_use_tenant_hint(user)
+        if use_hint:
+            # read before the lookup, so a tenant changed meanwhile is not
+            # remembered with the new version
+            version = get_tenant_version()
+            # without a version hints could never be invalidated
+            use_hint = version is not None
+        if use_hint:
+            tenant = self.get_hinted_tenant(request, tenant_model, user, version)
+            if tenant is not None:
+                return tenant
+
         try:
             tenant = self.get_tenant(tenant_model, user)
         except tenant_model.DoesNotExist:
             raise self.TENANT_NOT_FOUND_EXCEPTION('No tenant for user "{}"'.format(user))
 
-        request.tenant = tenant
+        if use_hint:
+            self.store_tenant_hint(request, tenant, user, version)
+        return tenant
 
-        connection.set_tenant(request.tenant)
+    def process_request(self, request):
+        # Connection needs first to be at the public schema, as this is where
+        # the tenant metadata is stored.
+        connection.set_schema_to_public()
 
-        # Content type can no longer be cached as public and tenant schemas
-        # have different models. If someone wants to change this, the cache
-        # needs to be separated between public and shared schemas. If this
-        # cache isn't cleared, this can cause permission problems. For example,
-        # on public, a particular model has id 14, but on the tenants it has
-        # the id 15. if 14 is cached instead of 15, the permissions for the
-        # wrong model will be fetched.
-        ContentType.objects.clear_cache()
+        if self.LAZY_ACTIVATION:
+            resolved = []
+
+            def resolve():
+                if not resolved:
+                    resolved.append(self.resolve_tenant(request))
+                    # no need for the lazy object anymore
+                    request.tenant = resolved[0]
+                return resolved[0]
+
+            request.tenant = SimpleLazyObject(resolve)
+            connection.set_tenant_lazy(resolve)
+        else:
+            request.tenant = self.resolve_tenant(request)
+            connection.set_tenant(request.tenant)
 
         # Do we have a public-specific urlconf?
         if hasattr(settings, 'PUBLIC_SCHEMA_URLCONF') and request.tenant.schema_name == get_public_schema_name():
             request.urlconf = settings.PUBLIC_SCHEMA_URLCONF
+
+    def process_response(self, request, response):
+        hint = getattr(request, '_tenant_hint', None)
+        if hint is not None:
+            response.set_signed_cookie(self.TENANT_HINT_NAME, json.dumps(hint), salt=self.TENANT_HINT_SALT,
+                                       max_age=settings.SESSION_COOKIE_AGE,
+                                       secure=settings.SESSION_COOKIE_SECURE or None,
+                                       httponly=True)
+        return response
@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject, empty
+from django.utils.module_loading import import_string
+
+from django_tenants.utils import get_tenant_database_alias, get_public_schema_name, get_metrics_flush_interval, \
+    get_metrics_handler
+
+logger = logging.getLogger('django_tenants.metrics')
+
+# upper bounds of the buckets, the last bucket counts everything above
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    """
+    Fixed size histogram, counting the values falling in each bucket.
+    """
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        for idx, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            idx = len(self.bounds)
+        self.counts[idx] += 1
+        self.total += value
+        self.count += 1
+
+    def as_dict(self):
+        return {
+            'buckets': list(zip(self.bounds + (None,), self.counts)),
+            'sum': self.total,
+            'count': self.count,
+        }
+
+
+class SchemaMetrics(object):
+    __slots__ = ('requests', 'latency', 'queries', 'db_time')
+
+    def __init__(self):
+        self.requests = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_time = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'latency': self.latency.as_dict(),
+            'queries': self.queries.as_dict(),
+            'db_time': self.db_time,
+        }
+
+
+class TenantMetrics(object):
+    """
+    Request metrics per schema, kept in memory and handed to the
+    TENANT_METRICS_HANDLER every TENANT_METRICS_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._schemas = {}
+        self._started = time.time()
+
+    def record(self, schema_name, latency, queries, db_time):
+        with self._lock:
+            metrics = self._schemas.get(schema_name)
+            if metrics is None:
+                metrics = self._schemas[schema_name] = SchemaMetrics()
+            metrics.requests += 1
+            metrics.latency.add(latency)
+            if queries is not None:
+                metrics.queries.add(queries)
+                metrics.db_time += db_time
+
+    def snapshot(self, reset=False):
+        """
+        Returns ``(started, ended, {schema_name: metrics})``.
+        """
+        with self._lock:
+            schemas, started, ended = self._schemas, self._started, time.time()
+            if reset:
+                self._schemas = {}
+                self._started = ended
+            # built under the lock, as record() may still be updating them
+            return started, ended, {schema_name: metrics.as_dict() for schema_name, metrics in schemas.items()}
+
+    def flush(self, force=False):
+        interval = get_metrics_flush_interval()
+        if not force and time.time() - self._started < interval:
+            return
+        with self._lock:
+            if not force and time.time() - self._started < interval:
+                # flushed by another thread meanwhile
+                return
+            # the next requests are counted in a new period
+            schemas, started, ended = self._schemas, self._started, time.time()
+            self._schemas, self._started = {}, ended
+        if schemas:
+            handler = get_metrics_handler()
+            if isinstance(handler, str):
+                handler = import_string(handler)
+            try:
+                handler(started, ended, {schema_name: metrics.as_dict() for schema_name, metrics in schemas.items()})
+            except Exception:
+                # metrics must never break the request
+                logger.exception('TENANT_METRICS_HANDLER failed')
+
+
+tenant_metrics = TenantMetrics()
+
+
+def log_metrics(started, ended, schemas):
+    """
+    Default TENANT_METRICS_HANDLER, logging one line per schema.
+    """
+    for schema_name, metrics in sorted(schemas.items()):
+        logger.info('%s: %d requests, %.3fs total, %d queries, %.3fs in the database',
+                    schema_name, metrics['requests'], metrics['latency']['sum'],
+                    metrics['queries']['sum'], metrics['db_time'])
+
+
+class QueryCounter(object):
+    """
+    Execute wrapper counting the queries of a request and their duration.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.time()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.time() - started
+
+
+class TenantMetricsMiddleware(MiddlewareMixin):
+    """
+    Records, for each schema, the number of requests, their latency, and the
+    number and duration of their queries. Place it right after the tenant
+    middleware. Queries are only counted on Django 2.0 or later, which
+    provide execute wrappers.
+    """
+
+    def process_request(self, request):
+        request._tenant_metrics_started = time.time()
+        connection = connections[get_tenant_database_alias()]
+        if hasattr(connection, 'execute_wrappers'):
+            request._tenant_metrics_queries = QueryCounter()
+            connection.execute_wrappers.append(request._tenant_metrics_queries)
+
+    def get_schema_name(self, request):
+        tenant = getattr(request, 'tenant', None)
+        if tenant is None or (isinstance(tenant, SimpleLazyObject) and tenant._wrapped is empty):
+            # no tenant, or a lazy one that was never needed, so the
+            # connection stayed on the public schema
+            return get_public_schema_name()
+        return tenant.schema_name
+
+    def process_response(self, request, response):
+        started = getattr(request, '_tenant_metrics_started', None)
+        if started is None:
+            return response
+
+        counter = getattr(request, '_tenant_metrics_queries', None)
+        if counter is not None:
+            connection = connections[get_tenant_database_alias()]
+            if counter in connection.execute_wrappers:
+                connection.execute_wrappers.remove(counter)
+            queries, db_time = counter.count, counter.time
+        else:
+            queries, db_time = None, 0.0
+
+        tenant_metrics.record(self.get_schema_name(request), time.time() - started, queries, db_time)
+        tenant_metrics.flush()
+        return response
@@ -2,7 +2,9 @@ import os
 
 from .base import MigrationExecutor
 from .multiproc import MultiprocessingExecutor
+from .replay import ReplayExecutor
 from .standard import StandardExecutor
+from .threaded import ThreadedExecutor
 
 
 def get_executor(codename=None):
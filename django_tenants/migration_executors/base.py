@@ -1,9 +1,105 @@
 import sys
+import time
+import traceback
+from collections import namedtuple
 
 from django.db import transaction
+from django.db.migrations.recorder import MigrationRecorder
 
+from django.core.management.base import CommandError
 from django.core.management.commands.migrate import Command as MigrateCommand
-from django_tenants.utils import get_public_schema_name, get_tenant_database_alias
+from django_tenants.migration_executors.loader import CachedMigrationLoader, cached_migrations
+from django_tenants.utils import get_public_schema_name, get_tenant_database_alias, get_fanout_batch_size, \
+    protect_case
+
+
+def get_leaf_migrations():
+    """
+    Returns the last migration of every app, mapped to the migrations it
+    replaces if it is a squashed one.
+    """
+    with cached_migrations():
+        loader = CachedMigrationLoader(None, ignore_no_migrations=True)
+        return {key: tuple(tuple(replaced) for replaced in loader.graph.nodes[key].replaces or ())
+                for key in loader.graph.leaf_nodes()}
+
+
+def get_applied_migrations(schema_names, database=None, batch_size=None, keys=None):
+    """
+    Returns the applied migrations of the given schemas, as a set of
+    ``(app, name)`` per schema, reading the django_migrations tables of all
+    schemas with one UNION ALL statement per batch. Schemas without a
+    django_migrations table are left out. When ``keys`` is given only those
+    migrations are read.
+    """
+    from django.db import connections
+    from django_tenants.postgresql_backend.base import _check_schema_name
+
+    schema_names = list(schema_names)
+    applied = {}
+    if not schema_names:
+        return applied
+    connection = connections[database or get_tenant_database_alias()]
+    table_name = connection.ops.quote_name(MigrationRecorder.Migration._meta.db_table)
+    if keys is not None:
+        condition = ' WHERE "app" || \'.\' || "name" = ANY(%s)'
+        params = [['%s.%s' % key for key in keys]]
+    else:
+        condition = ''
+        params = []
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT n.nspname FROM pg_catalog.pg_class c "
+                       "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+                       "WHERE c.relname = %s AND c.relkind = 'r' AND n.nspname = ANY(%s)",
+                       [MigrationRecorder.Migration._meta.db_table, schema_names])
+        migrated = set(row[0] for row in cursor.fetchall())
+
+        candidates = [schema_name for schema_name in schema_names if schema_name in migrated]
+        for schema_name in candidates:
+            applied[schema_name] = set()
+        batch_size = batch_size or get_fanout_batch_size()
+        for start in range(0, len(candidates), batch_size):
+            statements = []
+            statement_params = []
+            for schema_name in candidates[start:start + batch_size]:
+                _check_schema_name(schema_name)
+                statements.append('SELECT %%s, "app", "name" FROM %s.%s%s'
+                                  % (protect_case(schema_name), table_name, condition))
+                statement_params.append(schema_name)
+                statement_params.extend(params)
+            cursor.execute(' UNION ALL '.join(statements), statement_params)
+            for schema_name, app, name in cursor.fetchall():
+                applied[schema_name].add((app, name))
+
+    return applied
+
+
+def get_schemas_to_migrate(schema_names, database=None, batch_size=None):
+    """
+    Returns the given schemas except the ones where the last migration of
+    every app is already applied, reading the django_migrations tables of all
+    schemas with one UNION ALL statement per batch instead of running
+    migrate in each of them.
+    """
+    schema_names = list(schema_names)
+    if not schema_names:
+        return schema_names
+    leaves = get_leaf_migrations()
+    keys = set(leaves)
+    for replaced in leaves.values():
+        keys.update(replaced)
+    applied = get_applied_migrations(schema_names, database=database, batch_size=batch_size, keys=keys)
+
+    def is_current(schema_name):
+        if schema_name not in applied:
+            return False
+        for key, replaced in leaves.items():
+            if key not in applied[schema_name] and not (replaced and applied[schema_name].issuperset(replaced)):
+                return False
+        return True
+
+    return [schema_name for schema_name in schema_names if not is_current(schema_name)]
 
 
 def run_migrations(args, options, executor_codename, schema_name, allow_atomic=True, idx=None, count=None):
@@ -34,22 +130,80 @@ def run_migrations(args, options, executor_codename, schema_name, allow_atomic=T
     stderr.style_func = style_func
     if int(options.get('verbosity', 1)) >= 1:
         stdout.write(style.NOTICE("=== Starting migration"))
-    MigrateCommand(stdout=stdout, stderr=stderr).execute(*args, **options)
+    with cached_migrations():
+        MigrateCommand(stdout=stdout, stderr=stderr).execute(*args, **options)
 
     try:
         transaction.commit()
-        connection.close()
-        connection.connection = None
     except transaction.TransactionManagementError:
         if not allow_atomic:
             raise
 
-        # We are in atomic transaction, don't close connections
+        # We are in atomic transaction, nothing to commit yet
         pass
-
+    else:
+        journal = options.get('migration_journal')
+        if journal is not None:
+            journal.record(schema_name)
+
+    # The connection is kept open for the next schema, which only needs a new
+    # search_path and a clean session. The executors close it once they are
+    # done.
+    reset_session(connection)
     connection.set_schema_to_public()
 
 
+def reset_session(connection):
+    """
+    Discards the session state the migrations of a schema may have left on
+    the connection, such as settings (session_replication_role,
+    statement_timeout, ...), temporary tables and advisory locks, so it
+    doesn't carry over to the next schema. Nothing is done inside a
+    transaction, as when a tenant is created in a test case.
+    """
+    if connection.connection is None or connection.in_atomic_block or not connection.get_autocommit():
+        return
+    with connection.connection.cursor() as cursor:
+        cursor.execute('DISCARD ALL')
+    # the search_path is reset as well
+    connection.search_path_applied = None
+    connection.search_path_set = False
+
+
+def close_connection():
+    """
+    Closes the connection to the tenant database of the current thread,
+    unless migrations run in a transaction of the caller, as when a tenant
+    is created in a test case.
+    """
+    from django.db import connections
+
+    connection = connections[get_tenant_database_alias()]
+    if connection.in_atomic_block:
+        return
+    connection.close()
+    connection.connection = None
+
+
+MigrationResult = namedtuple('MigrationResult', ['schema_name', 'success', 'duration', 'error'])
+
+
+def run_migrations_safe(args, options, executor_codename, schema_name, **kwargs):
+    """
+    Runs run_migrations and returns a MigrationResult instead of raising, the
+    error being the formatted traceback so it can be sent between processes.
+    """
+    started = time.time()
+    try:
+        run_migrations(args, options, executor_codename, schema_name, **kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        # the connection may be left in any state, the next schema gets a new one
+        close_connection()
+        return MigrationResult(schema_name, False, time.time() - started, error)
+    return MigrationResult(schema_name, True, time.time() - started, None)
+
+
 class MigrationExecutor(object):
     codename = None
 
@@ -62,3 +216,16 @@ class MigrationExecutor(object):
 
     def run_migrations(self, tenants=None):
         raise NotImplementedError
+
+    def check_results(self, results):
+        """
+        Reports the schemas that failed to migrate, raising a CommandError
+        (non-zero exit) if there is any.
+        """
+        failed = [result for result in results if not result.success]
+        if not failed:
+            return
+        for result in failed:
+            sys.stderr.write('[%s:%s] %s\n' % (self.codename, result.schema_name, result.error))
+        raise CommandError('Migrations failed on %d of %d schemas: %s' % (
+            len(failed), len(results), ', '.join(result.schema_name for result in failed)))
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+
+
+def get_plan_hash(leaf_migrations, options, settings_dict):
+    """
+    Identifies what a migrate_schemas run does: the database it migrates, the
+    last migration of every app and the options changing which migrations
+    are applied.
+    """
+    plan = {
+        'database': [settings_dict.get(name) for name in ('NAME', 'HOST', 'PORT')],
+        'leaves': sorted('%s.%s' % key for key in leaf_migrations),
+        'options': [options.get(name) for name in ('app_label', 'migration_name', 'fake', 'fake_initial')],
+    }
+    return hashlib.sha1(json.dumps(plan, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class MigrationJournal(object):
+    """
+    JSON lines file recording the schemas migrated by migrate_schemas, one
+    line per schema, so an interrupted run can be resumed. Only the lines of
+    the same plan count. Each line is appended with a single write, so the
+    workers of the parallel executors can share the file.
+    """
+
+    def __init__(self, path, plan_hash):
+        self.path = path
+        self.plan_hash = plan_hash
+
+    def truncate(self):
+        with open(self.path, 'w'):
+            pass
+
+    def record(self, schema_name):
+        line = json.dumps({'plan': self.plan_hash, 'schema': schema_name}) + '\n'
+        with open(self.path, 'a') as journal:
+            journal.write(line)
+
+    def get_completed(self):
+        """
+        Returns the schemas recorded under the same plan.
+        """
+        completed = set()
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line cut by the interruption
+                    continue
+                if entry.get('plan') == self.plan_hash:
+                    completed.add(entry['schema'])
+        return completed
@@ -0,0 +1,166 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.management.commands import migrate
+from django.db.migrations.executor import MigrationExecutor as DjangoMigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+
+# project states kept, one per distinct set of applied migrations
+MAX_CACHED_STATES = 16
+
+
+class MigrationCache(object):
+    """
+    What migrate computes again for every schema although it only depends on
+    the migration files: the migrations loaded from disk, the graph, the full
+    plan and the project states. The graph only changes with the squashed
+    migrations that are partially applied, so it is kept per set of those.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # held while reading the migration files and building a graph, which
+        # reloads the migration modules and must not run in several threads
+        self.load_lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.disk = {}
+            self.graphs = {}
+            self.plans = {}
+            self.states = OrderedDict()
+
+    def get_state(self, key):
+        with self._lock:
+            return self.states.get(key)
+
+    def set_state(self, key, state):
+        with self._lock:
+            self.states[key] = state
+            while len(self.states) > MAX_CACHED_STATES:
+                self.states.popitem(last=False)
+
+
+migration_cache = MigrationCache()
+
+
+class CachedMigrationLoader(MigrationLoader):
+    """
+    MigrationLoader reading the migration files and building the graph once
+    per process, only the applied migrations being read for every schema.
+    """
+
+    def load_disk(self):
+        with migration_cache.load_lock:
+            disk = migration_cache.disk.get(self.ignore_no_migrations)
+            if disk is None:
+                super(CachedMigrationLoader, self).load_disk()
+                migration_cache.disk[self.ignore_no_migrations] = (
+                    self.disk_migrations, frozenset(self.unmigrated_apps), frozenset(self.migrated_apps))
+                return
+        self.disk_migrations = disk[0]
+        self.unmigrated_apps, self.migrated_apps = set(disk[1]), set(disk[2])
+
+    def build_graph(self):
+        self.load_disk()
+        if self.connection is None:
+            applied_migrations = set()
+        else:
+            applied_migrations = MigrationRecorder(self.connection).applied_migrations()
+
+        partially_applied = set()
+        for key, migration in self.disk_migrations.items():
+            if migration.replaces:
+                applied = [target in applied_migrations for target in migration.replaces]
+                if any(applied) and not all(applied):
+                    partially_applied.add(key)
+        self.graph_key = (self.ignore_no_migrations, frozenset(partially_applied))
+
+        with migration_cache.load_lock:
+            cached = migration_cache.graphs.get(self.graph_key)
+            if cached is None:
+                super(CachedMigrationLoader, self).build_graph()
+                migration_cache.graphs[self.graph_key] = (self.graph, self.replacements)
+                return
+
+        # Same as MigrationLoader.build_graph, without building the graph
+        self.graph, self.replacements = cached
+        self.applied_migrations = applied_migrations
+        for key, migration in self.replacements.items():
+            if all(target in applied_migrations for target in migration.replaces):
+                self.applied_migrations.add(key)
+            else:
+                self.applied_migrations.discard(key)
+
+    def project_state(self, nodes=None, at_end=True):
+        if nodes is not None or not at_end:
+            return super(CachedMigrationLoader, self).project_state(nodes=nodes, at_end=at_end)
+        key = (self.graph_key, None)
+        state = migration_cache.get_state(key)
+        if state is None:
+            state = super(CachedMigrationLoader, self).project_state()
+            migration_cache.set_state(key, state)
+        return state.clone()
+
+
+class CachedMigrationExecutor(DjangoMigrationExecutor):
+    """
+    The MigrationExecutor used by migrate while the migrations are cached,
+    sharing the graph, the full plan and the project states between schemas.
+    """
+
+    def __init__(self, connection, progress_callback=None):
+        self.connection = connection
+        self.loader = CachedMigrationLoader(self.connection)
+        self.recorder = MigrationRecorder(self.connection)
+        self.progress_callback = progress_callback
+
+    def migration_plan(self, targets, clean_start=False):
+        graph_key = self.loader.graph_key
+        if not clean_start or set(targets) != set(self.loader.graph.leaf_nodes()):
+            return super(CachedMigrationExecutor, self).migration_plan(targets, clean_start=clean_start)
+        plan = migration_cache.plans.get(graph_key)
+        if plan is None:
+            plan = migration_cache.plans[graph_key] = super(CachedMigrationExecutor, self).migration_plan(
+                targets, clean_start=clean_start)
+        return list(plan)
+
+    def _create_project_state(self, with_applied_migrations=False):
+        if not with_applied_migrations:
+            return super(CachedMigrationExecutor, self)._create_project_state()
+        key = (self.loader.graph_key,
+               frozenset(key for key in self.loader.applied_migrations if key in self.loader.graph.nodes))
+        state = migration_cache.get_state(key)
+        if state is None:
+            state = super(CachedMigrationExecutor, self)._create_project_state(with_applied_migrations=True)
+            migration_cache.set_state(key, state)
+        return state.clone()
+
+
+_lock = threading.Lock()
+_users = 0
+
+
+@contextmanager
+def cached_migrations():
+    """
+    Makes migrate use CachedMigrationExecutor. It can be nested and entered by
+    several threads, the cache being dropped when the last one exits, so
+    migration files changed afterwards are seen again.
+    """
+    global _users
+    with _lock:
+        if not _users:
+            migrate.MigrationExecutor = CachedMigrationExecutor
+        _users += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _users -= 1
+            if not _users:
+                migrate.MigrationExecutor = DjangoMigrationExecutor
+                migration_cache.clear()
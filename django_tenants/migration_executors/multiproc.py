@@ -1,14 +1,23 @@
 import functools
 import multiprocessing
+import sys
+from multiprocessing.util import Finalize
 
 from django.conf import settings
+from django.db import connections
 
-from .base import MigrationExecutor, run_migrations
+from .base import MigrationExecutor, close_connection, run_migrations, run_migrations_safe
+
+
+def init_worker():
+    # A worker keeps its connection open between the schemas it migrates and
+    # closes it when it exits
+    Finalize(None, close_connection, exitpriority=10)
 
 
 def run_migrations_percent(args, options, codename, count, idx_schema_name):
     idx, schema_name = idx_schema_name
-    return run_migrations(
+    return run_migrations_safe(
         args,
         options,
         codename,
@@ -26,10 +35,21 @@ class MultiprocessingExecutor(MigrationExecutor):
         tenants = tenants or []
 
         if self.PUBLIC_SCHEMA_NAME in tenants:
-            run_migrations(self.args, self.options, self.codename, self.PUBLIC_SCHEMA_NAME)
+            try:
+                run_migrations(self.args, self.options, self.codename, self.PUBLIC_SCHEMA_NAME)
+            finally:
+                close_connection()
             tenants.pop(tenants.index(self.PUBLIC_SCHEMA_NAME))
 
-        if tenants:
+        if tenants and connections[self.TENANT_DB_ALIAS].in_atomic_block:
+            # The workers would inherit the connection, and the transaction,
+            # of this process, and one of their own would not see the
+            # uncommitted schemas, so they are migrated here
+            results = [run_migrations_safe(self.args, self.options, self.codename, schema_name,
+                                           idx=idx, count=len(tenants))
+                       for idx, schema_name in enumerate(tenants)]
+            self.check_results(results)
+        elif tenants:
             processes = getattr(
                 settings,
                 'TENANT_MULTIPROCESSING_MAX_PROCESSES',
@@ -38,14 +58,11 @@ class MultiprocessingExecutor(MigrationExecutor):
             chunks = getattr(
                 settings,
                 'TENANT_MULTIPROCESSING_CHUNKS',
-                2
+                1
             )
 
-            from django.db import connections
-
-            connection = connections[self.TENANT_DB_ALIAS]
-            connection.close()
-            connection.connection = None
+            # the workers must not share the connection of this process
+            close_connection()
 
             run_migrations_p = functools.partial(
                 run_migrations_percent,
@@ -54,9 +71,19 @@ class MultiprocessingExecutor(MigrationExecutor):
                 self.codename,
                 len(tenants)
             )
-            p = multiprocessing.Pool(processes=processes)
-            p.map(
-                run_migrations_p,
-                enumerate(tenants),
-                chunks
-            )
+            # Schemas are handed out as workers become free, so a slow schema
+            # only holds up its own worker, and a failing one does not stop
+            # the others.
+            p = multiprocessing.Pool(processes=processes, initializer=init_worker)
+            results = []
+            try:
+                for result in p.imap_unordered(run_migrations_p, enumerate(tenants), chunks):
+                    if not result.success:
+                        sys.stderr.write('[%s:%s] Migration failed after %.1fs\n' % (
+                            self.codename, result.schema_name, result.duration))
+                    results.append(result)
+            finally:
+                p.close()
+                p.join()
+
+            self.check_results(results)
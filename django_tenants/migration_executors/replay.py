@@ -0,0 +1,264 @@
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+from django.core.management import color
+from django.core.management.sql import emit_post_migrate_signal, emit_pre_migrate_signal
+from django.db import connections, transaction
+from django.db.migrations.operations import SeparateDatabaseAndState
+from django.db.migrations.recorder import MigrationRecorder
+
+from .base import MigrationExecutor, MigrationResult, close_connection, get_applied_migrations, reset_session, \
+    run_migrations, run_migrations_safe
+from .loader import CachedMigrationExecutor, cached_migrations
+
+
+# Statements the schema editor may run on its own to read the catalog, or
+# the transaction management around it
+IGNORED_STATEMENTS = ('SELECT ', 'SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ')
+
+
+class NotReplayable(Exception):
+    pass
+
+
+def is_replayable_operation(operation):
+    if isinstance(operation, SeparateDatabaseAndState):
+        # reduces_to_sql is inherited whatever the operations it wraps
+        return all(is_replayable_operation(database_operation)
+                   for database_operation in operation.database_operations)
+    return operation.reduces_to_sql
+
+
+def is_replayable(migration):
+    """
+    Tells if the SQL of a migration can be generated in advance, that is if
+    it runs in a transaction and has no Python operation.
+    """
+    return migration.atomic and all(is_replayable_operation(operation) for operation in migration.operations)
+
+
+def record_migration(recorder, migration):
+    # as MigrationExecutor.record_migration does
+    if migration.replaces:
+        for app_label, name in migration.replaces:
+            recorder.record_applied(app_label, name)
+    else:
+        recorder.record_applied(migration.app_label, migration.name)
+
+
+def apply_and_collect_sql(executor, plan, state):
+    """
+    Applies a plan on the schema of the executor's connection, as migrate
+    does, and returns the SQL statements it executed, as ``(sql, params)``
+    pairs, and the project state after the plan. The params are kept apart
+    so the connection quotes them when they are replayed. The plan is
+    really applied, as operations introspecting the database must see the
+    changes of the previous migrations.
+
+    Raises NotReplayable, before running it, on a statement an operation
+    runs without the schema editor, such as a write through the ORM, as it
+    would not be replayed on the other schemas.
+    """
+    statements = []
+    # set while the schema editor or the recorder run a statement
+    expected = []
+
+    def check_statement(execute, sql, params, many, context):
+        if not expected and not str(sql).lstrip().upper().startswith(IGNORED_STATEMENTS):
+            raise NotReplayable('Statement run without the schema editor: %s' % sql)
+        return execute(sql, params, many, context)
+
+    with executor.connection.execute_wrapper(check_statement):
+        for migration, backwards in plan:
+            with executor.connection.schema_editor(atomic=migration.atomic) as schema_editor:
+                execute = schema_editor.execute
+
+                def execute_and_collect(sql, params=(), execute=execute):
+                    expected.append(sql)
+                    try:
+                        execute(sql, params)
+                    finally:
+                        expected.pop()
+                    # the deferred SQL comes as Statement objects
+                    statements.append((str(sql), params))
+
+                schema_editor.execute = execute_and_collect
+                state = migration.apply(state, schema_editor)
+                expected.append(migration)
+                try:
+                    record_migration(executor.recorder, migration)
+                finally:
+                    expected.pop()
+    return statements, state
+
+
+class ReplayExecutor(MigrationExecutor):
+    """
+    Groups the tenant schemas by applied migrations and, for every group,
+    applies the pending migrations on the first schema while recording their
+    SQL, then runs that SQL in each other schema of the group and records the
+    migrations, without going through migrate. Groups whose plan has
+    RunPython or non atomic migrations, or whose first schema fails, are
+    migrated as usual, as is every schema whose replay fails.
+    """
+    codename = 'replay'
+
+    def run_migrations(self, tenants=None):
+        tenants = tenants or []
+
+        if self.PUBLIC_SCHEMA_NAME in tenants:
+            run_migrations(self.args, self.options, self.codename, self.PUBLIC_SCHEMA_NAME)
+            tenants.pop(tenants.index(self.PUBLIC_SCHEMA_NAME))
+
+        if not tenants:
+            close_connection()
+            return
+
+        if not self.can_replay():
+            try:
+                results = [run_migrations_safe(self.args, self.options, self.codename, schema_name,
+                                               idx=idx, count=len(tenants))
+                           for idx, schema_name in enumerate(tenants)]
+            finally:
+                close_connection()
+            self.check_results(results)
+            return
+
+        applied = get_applied_migrations(tenants, database=self.TENANT_DB_ALIAS)
+        groups = OrderedDict()
+        # schemas without a django_migrations table are migrated as usual
+        unmigrated = []
+        for schema_name in tenants:
+            if schema_name in applied:
+                groups.setdefault(frozenset(applied[schema_name]), []).append(schema_name)
+            else:
+                unmigrated.append(schema_name)
+
+        results = []
+        try:
+            with cached_migrations():
+                for schema_names in groups.values():
+                    try:
+                        results.extend(self.replay_group(schema_names))
+                    except Exception:
+                        sys.stderr.write('[%s:%s] Replay failed, running migrate on %d schemas\n%s' % (
+                            self.codename, schema_names[0], len(schema_names), traceback.format_exc()))
+                        # the connection may be left in any state
+                        close_connection()
+                        results.extend(run_migrations_safe(self.args, self.options, self.codename, schema_name)
+                                       for schema_name in schema_names)
+            for schema_name in unmigrated:
+                results.append(run_migrations_safe(self.args, self.options, self.codename, schema_name))
+        finally:
+            close_connection()
+        self.check_results(results)
+
+    def can_replay(self):
+        """
+        Only a full migration of the schemas is replayed, targeting or faking
+        migrations goes through migrate. Without execute wrappers (Django
+        1.11) statements run outside of the schema editor can't be detected,
+        so nothing is replayed.
+        """
+        options = self.options
+        if not hasattr(connections[self.TENANT_DB_ALIAS], 'execute_wrappers'):
+            return False
+        return not (options.get('app_label') or options.get('migration_name') or options.get('list') or
+                    options.get('run_syncdb') or options.get('fake') or options.get('fake_initial'))
+
+    def write(self, schema_name, msg):
+        if int(self.options.get('verbosity', 1)) >= 1:
+            style = color.color_style()
+            sys.stdout.write('[%s:%s] %s\n' % (style.NOTICE(self.codename), style.NOTICE(schema_name), msg))
+
+    def replay_group(self, schema_names):
+        """
+        Migrates the first schema of the group and replays its SQL on the
+        others. Raises if the first schema fails, the others each get their
+        MigrationResult.
+        """
+        connection = connections[self.TENANT_DB_ALIAS]
+        verbosity = int(self.options.get('verbosity', 1))
+        interactive = self.options.get('interactive', False)
+        first_schema_name = schema_names[0]
+        started = time.time()
+        connection.set_schema(first_schema_name, include_public=False)
+        try:
+            executor = CachedMigrationExecutor(connection)
+            plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+            replayable = all(is_replayable(migration) for migration, backwards in plan)
+            if replayable:
+                self.write(first_schema_name, 'Applying %d migrations to replay them on %d more schemas'
+                           % (len(plan), len(schema_names) - 1))
+                pre_migrate_state = executor._create_project_state(with_applied_migrations=True)
+                # rendered once for the signals of all the schemas
+                pre_migrate_apps = pre_migrate_state.apps
+                emit_pre_migrate_signal(verbosity, interactive, connection.alias, apps=pre_migrate_apps, plan=plan)
+                try:
+                    statements, post_migrate_state = apply_and_collect_sql(executor, plan,
+                                                                           pre_migrate_state.clone())
+                except NotReplayable as e:
+                    # the migration running it was rolled back, migrate
+                    # picks up from there
+                    replayable = False
+                    self.write(first_schema_name, str(e))
+                else:
+                    post_migrate_apps = post_migrate_state.apps
+                    emit_post_migrate_signal(verbosity, interactive, connection.alias, apps=post_migrate_apps,
+                                             plan=plan)
+            else:
+                self.write(first_schema_name, 'Migrations with Python code or not atomic')
+        finally:
+            connection.set_schema_to_public()
+        reset_session(connection)
+
+        if not replayable:
+            self.write(first_schema_name, 'Running migrate on %d schemas' % len(schema_names))
+            return [run_migrations_safe(self.args, self.options, self.codename, schema_name)
+                    for schema_name in schema_names]
+
+        self.record_journal(first_schema_name)
+        results = [MigrationResult(first_schema_name, True, time.time() - started, None)]
+        self.write(first_schema_name, 'Replaying %d migrations (%d statements) on %d schemas'
+                   % (len(plan), len(statements), len(schema_names) - 1))
+        for schema_name in schema_names[1:]:
+            result = self.replay(schema_name, plan, statements, pre_migrate_apps, post_migrate_apps)
+            if not result.success:
+                sys.stderr.write('[%s:%s] Replay failed, running migrate\n%s' % (
+                    self.codename, schema_name, result.error))
+                result = run_migrations_safe(self.args, self.options, self.codename, schema_name)
+            results.append(result)
+        return results
+
+    def record_journal(self, schema_name):
+        journal = self.options.get('migration_journal')
+        if journal is not None:
+            journal.record(schema_name)
+
+    def replay(self, schema_name, plan, statements, pre_migrate_apps, post_migrate_apps):
+        connection = connections[self.TENANT_DB_ALIAS]
+        verbosity = int(self.options.get('verbosity', 1))
+        interactive = self.options.get('interactive', False)
+        started = time.time()
+        try:
+            connection.set_schema(schema_name, include_public=False)
+            emit_pre_migrate_signal(verbosity, interactive, connection.alias, apps=pre_migrate_apps, plan=plan)
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    for sql, params in statements:
+                        cursor.execute(sql, params)
+                recorder = MigrationRecorder(connection)
+                for migration, backwards in plan:
+                    record_migration(recorder, migration)
+            emit_post_migrate_signal(verbosity, interactive, connection.alias, apps=post_migrate_apps, plan=plan)
+            self.record_journal(schema_name)
+        except Exception:
+            error = traceback.format_exc()
+            close_connection()
+            return MigrationResult(schema_name, False, time.time() - started, error)
+        finally:
+            connection.set_schema_to_public()
+        reset_session(connection)
+        return MigrationResult(schema_name, True, time.time() - started, None)
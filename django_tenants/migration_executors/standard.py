@@ -1,4 +1,4 @@
-from .base import MigrationExecutor, run_migrations
+from .base import MigrationExecutor, close_connection, run_migrations
 
 
 class StandardExecutor(MigrationExecutor):
@@ -7,9 +7,12 @@ class StandardExecutor(MigrationExecutor):
     def run_migrations(self, tenants=None):
         tenants = tenants or []
 
-        if self.PUBLIC_SCHEMA_NAME in tenants:
-            run_migrations(self.args, self.options, self.codename, self.PUBLIC_SCHEMA_NAME)
-            tenants.pop(tenants.index(self.PUBLIC_SCHEMA_NAME))
+        try:
+            if self.PUBLIC_SCHEMA_NAME in tenants:
+                run_migrations(self.args, self.options, self.codename, self.PUBLIC_SCHEMA_NAME)
+                tenants.pop(tenants.index(self.PUBLIC_SCHEMA_NAME))
 
-        for idx, schema_name in enumerate(tenants):
-            run_migrations(self.args, self.options, self.codename, schema_name, idx=idx, count=len(tenants))
+            for idx, schema_name in enumerate(tenants):
+                run_migrations(self.args, self.options, self.codename, schema_name, idx=idx, count=len(tenants))
+        finally:
+            close_connection()
@@ -0,0 +1,70 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections
+
+from django_tenants.utils import get_tenant_database_alias
+
+from .base import MigrationExecutor, close_connection, run_migrations, run_migrations_safe
+
+
+def run_migrations_thread(args, options, codename, count, used_connections, idx, schema_name):
+    # Connections are per thread, the one of this thread is kept open for the
+    # next schemas and closed by the executor at the end
+    used_connections.add(connections[get_tenant_database_alias()])
+    return run_migrations_safe(
+        args,
+        options,
+        codename,
+        schema_name,
+        allow_atomic=False,
+        idx=idx,
+        count=count
+    )
+
+
+class ThreadedExecutor(MigrationExecutor):
+    codename = 'threaded'
+
+    def run_migrations(self, tenants=None):
+        tenants = tenants or []
+
+        if self.PUBLIC_SCHEMA_NAME in tenants:
+            try:
+                run_migrations(self.args, self.options, self.codename, self.PUBLIC_SCHEMA_NAME)
+            finally:
+                close_connection()
+            tenants.pop(tenants.index(self.PUBLIC_SCHEMA_NAME))
+
+        if tenants:
+            max_workers = getattr(
+                settings,
+                'TENANT_THREADED_MAX_WORKERS',
+                4
+            )
+
+            # The threads share the app registry already loaded by this
+            # process, each one opening its own database connection.
+            results = []
+            used_connections = set()
+            try:
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    futures = [
+                        pool.submit(run_migrations_thread, self.args, self.options, self.codename, len(tenants),
+                                    used_connections, idx, schema_name)
+                        for idx, schema_name in enumerate(tenants)
+                    ]
+                    for future in as_completed(futures):
+                        result = future.result()
+                        if not result.success:
+                            sys.stderr.write('[%s:%s] Migration failed after %.1fs\n' % (
+                                self.codename, result.schema_name, result.duration))
+                        results.append(result)
+            finally:
+                for connection in used_connections:
+                    # the worker threads are done with it
+                    connection.allow_thread_sharing = True
+                    connection.close()
+
+            self.check_results(results)
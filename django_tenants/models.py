@@ -1,10 +1,12 @@
+from django.conf import settings
 from django.db import models, connections
 from django.core.management import call_command
 # noinspection PyProtectedMember
 from psycopg2.extensions import AsIs
 from .postgresql_backend.base import _check_schema_name
 from .signals import post_schema_sync, schema_needs_to_be_sync, post_schema_migrate
-from .utils import get_public_schema_name, get_creation_fakes_migrations, get_tenant_database_alias, schema_exists, clone_schema, get_tenant_base_schema
+from .utils import get_public_schema_name, get_creation_fakes_migrations, get_tenant_database_alias, schema_exists, clone_schema, get_tenant_base_schema, \
+    get_tenant_domain_model
 
 
 class TenantMixin(models.Model):
@@ -110,6 +112,15 @@ class TenantMixin(models.Model):
                 self.schema_name = None
                 raise
 
+    def get_primary_domain(self):
+        """
+        Returns the primary domain of the tenant, or None if it has none.
+        """
+        try:
+            return self.domains.get(is_primary=True)
+        except get_tenant_domain_model().DoesNotExist:
+            return None
+
     def serializable_fields(self):
         """ in certain cases the user model isn't serializable so you may want to only send the id """
         return self
@@ -178,3 +189,22 @@ class TenantMixin(models.Model):
                 raise
 
         connection.set_schema_to_public()
+
+
+class DomainMixin(models.Model):
+    """
+    All models that store the domains must inherit this class.
+    """
+    domain = models.CharField(max_length=253, unique=True, db_index=True)
+    tenant = models.ForeignKey(settings.TENANT_MODEL, related_name='domains', on_delete=models.CASCADE)
+
+    is_primary = models.BooleanField(default=True)
+    """
+    Set this to true if this is the domain used to build urls to the tenant.
+    """
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.domain
@@ -1,14 +1,29 @@
+import os
 import re
+import time
+import weakref
 import warnings
+from collections import namedtuple
+from collections.abc import Mapping
+from functools import lru_cache
 from django.conf import settings
 from importlib import import_module
 
 from django.core.exceptions import ImproperlyConfigured, ValidationError
-from django_tenants.utils import get_public_schema_name, get_limit_set_calls, protect_case
+from django_tenants.utils import get_public_schema_name, get_limit_set_calls, get_piggyback_search_path, \
+    get_local_search_path, get_schema_qualified_sql, get_connection_pool_switch, protect_case
 from django_tenants.postgresql_backend.introspection import DatabaseSchemaIntrospection
+from django_tenants.postgresql_backend.pool import get_connection_pool
+from django_tenants.postgresql_backend.stats import SearchPathStats, process_stats
+from django_tenants.signals import search_path_changed
 import django.db.utils
 import psycopg2
-from psycopg2.extensions import AsIs
+from psycopg2.extensions import AsIs, TRANSACTION_STATUS_IDLE
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
 
 
 DatabaseError = django.db.utils.DatabaseError
@@ -20,6 +35,11 @@ original_backend = import_module(ORIGINAL_BACKEND + '.base')
 
 EXTRA_SEARCH_PATHS = getattr(settings, 'PG_EXTRA_SEARCH_PATHS', [])
 
+# number of validated search_path strings and fake tenants kept in memory
+SEARCH_PATH_CACHE_SIZE = getattr(settings, 'TENANT_SEARCH_PATH_CACHE_SIZE', 1024)
+
+SchemaState = namedtuple('SchemaState', ['tenant', 'schema_name', 'include_public', 'pending_tenant'])
+
 # from the postgresql doc
 SQL_IDENTIFIER_RE = re.compile(r'^[_a-zA-Z][_a-zA-Z0-9]{,62}$')
 SQL_SCHEMA_NAME_RESERVED_RE = re.compile(r'^pg_', re.IGNORECASE)
@@ -43,60 +63,309 @@ def _check_schema_name(name):
         raise ValidationError("Invalid string used for the schema name.")
 
 
+@lru_cache(maxsize=SEARCH_PATH_CACHE_SIZE)
+def _get_search_path(schema_name, include_public, public_schema_name):
+    """
+    Returns the validated and quoted search_path for a schema. Memoized, as
+    this is computed for every cursor.
+    """
+    _check_schema_name(schema_name)
+
+    if schema_name == public_schema_name:
+        search_paths = [protect_case(public_schema_name)]
+    elif include_public:
+        search_paths = [protect_case(schema_name), protect_case(public_schema_name)]
+    else:
+        search_paths = [protect_case(schema_name)]
+
+    search_paths.extend([protect_case(extra_path) for extra_path in EXTRA_SEARCH_PATHS])
+    return ','.join(search_paths)
+
+
+@lru_cache(maxsize=SEARCH_PATH_CACHE_SIZE)
+def _get_fake_tenant(schema_name):
+    return FakeTenant(schema_name=schema_name)
+
+
+class SchemaOperationsMixin(object):
+    """
+    Hands out SQL compilers emitting schema qualified table names when
+    TENANT_SCHEMA_QUALIFIED_SQL is set.
+    """
+    def compiler(self, compiler_name):
+        compiler_class = super(SchemaOperationsMixin, self).compiler(compiler_name)
+        if get_schema_qualified_sql():
+            from django_tenants.postgresql_backend.compiler import schema_qualified_compiler
+            return schema_qualified_compiler(compiler_class)
+        return compiler_class
+
+
+class DatabaseSchemaOperations(SchemaOperationsMixin, original_backend.DatabaseWrapper.ops_class):
+    pass
+
+
+@lru_cache(maxsize=None)
+def _get_schema_operations_class(ops_class):
+    if issubclass(ops_class, SchemaOperationsMixin):
+        return ops_class
+    return type('Schema' + ops_class.__name__, (SchemaOperationsMixin, ops_class), {})
+
+
 class DatabaseWrapper(original_backend.DatabaseWrapper):
     """
     Adds the capability to manipulate the search_path using set_tenant and set_schema_name
     """
-    include_public_schema = True
+    ops_class = DatabaseSchemaOperations
 
     def __init__(self, *args, **kwargs):
         self.search_path_set = None
-        self.tenant = None
-        self.schema_name = None
+        self.schema_qualified_query = False
+        self.search_path_applied = None
+        self._schema_state = SchemaState(None, None, True, None)
+        # Tenant of this connection in the current context, so coroutines
+        # sharing the connection each keep their own. Falls back to
+        # _schema_state when not set in this context.
+        self._schema_state_var = contextvars.ContextVar('django_tenants_schema_state',
+                                                        default=None) if contextvars else None
+        self._pool_key = None
+        self._search_path_cursor = None
+        self._open_cursors = weakref.WeakSet()
+        self.search_path_stats = SearchPathStats()
         super(DatabaseWrapper, self).__init__(*args, **kwargs)
 
+        # Backends such as PostGIS replace ops in their __init__ instead of
+        # using ops_class
+        self.ops = _get_schema_operations_class(type(self.ops))(self)
+
         # Use a patched version of the DatabaseIntrospection that only returns the table list for the
         # currently selected schema.
         self.introspection = DatabaseSchemaIntrospection(self)
         self.set_schema_to_public()
 
+    def connect(self):
+        # A new physical connection starts with the server default search_path
+        self.search_path_applied = None
+        super(DatabaseWrapper, self).connect()
+
+    def get_new_connection(self, conn_params):
+        pool = get_connection_pool()
+        if pool is not None:
+            self._pool_key = (os.getpid(), self.alias, repr(sorted(conn_params.items())))
+            connection, search_path = pool.acquire(self._pool_key, self._get_current_search_path())
+            if connection is not None:
+                self.search_path_applied = search_path
+                return connection
+        return super(DatabaseWrapper, self).get_new_connection(conn_params)
+
+    def create_cursor(self, name=None):
+        cursor = super(DatabaseWrapper, self).create_cursor(name)
+        self._open_cursors.add(cursor)
+        return cursor
+
     def close(self):
-        self.search_path_set = False
-        super(DatabaseWrapper, self).close()
+        try:
+            super(DatabaseWrapper, self).close()
+        finally:
+            self.search_path_set = False
+            self.search_path_applied = None
+            self._search_path_cursor = None
+
+    def _close(self):
+        pool = get_connection_pool()
+        if (pool is not None and self._pool_key is not None and self._pool_key[0] == os.getpid() and
+                self._is_poolable() and not self.errors_occurred):
+            # Keep the connection, and the search_path applied on it, for reuse
+            try:
+                self._reset_session()
+            except psycopg2.Error:
+                pass
+            else:
+                if pool.release(self._pool_key, self.connection, self.search_path_applied):
+                    return
+        return super(DatabaseWrapper, self)._close()
+
+    def _is_poolable(self):
+        """
+        Only a connection without open cursors and outside of a transaction
+        can be given to somebody else.
+        """
+        if self.connection is None or self.connection.closed:
+            return False
+        if self.connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            return False
+        return not any(not cursor.closed for cursor in list(self._open_cursors)
+                       if cursor is not self._search_path_cursor)
+
+    def _reset_session(self):
+        """
+        Discards the session state (settings, temporary tables, prepared
+        statements, ...) before the connection goes back to the pool and
+        applies the search_path again.
+        """
+        if self._search_path_cursor is not None:
+            self._search_path_cursor.close()
+            self._search_path_cursor = None
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute('DISCARD ALL')
+            if self.search_path_applied is not None:
+                cursor.execute('SET search_path = %s', (AsIs(self.search_path_applied),))
+
+    def _commit(self):
+        if get_local_search_path():
+            # SET LOCAL only lasts until the end of the transaction
+            self.search_path_applied = None
+        return super(DatabaseWrapper, self)._commit()
+
+    def _rollback(self):
+        # A SET issued inside the rolled back transaction is reverted as well
+        self.search_path_applied = None
+        return super(DatabaseWrapper, self)._rollback()
+
+    def _savepoint_rollback(self, sid):
+        self.search_path_applied = None
+        super(DatabaseWrapper, self)._savepoint_rollback(sid)
+
+    def _get_schema_state(self):
+        if self._schema_state_var is not None:
+            state = self._schema_state_var.get()
+            if state is not None:
+                return state
+        return self._schema_state
+
+    def _update_schema_state(self, **changes):
+        state = self._get_schema_state()._replace(**changes)
+        self._schema_state = state
+        if self._schema_state_var is not None:
+            self._schema_state_var.set(state)
+
+    @property
+    def tenant(self):
+        self.activate_pending_tenant()
+        return self._get_schema_state().tenant
+
+    @tenant.setter
+    def tenant(self, tenant):
+        self._update_schema_state(tenant=tenant)
+
+    @property
+    def schema_name(self):
+        self.activate_pending_tenant()
+        return self._get_schema_state().schema_name
+
+    @schema_name.setter
+    def schema_name(self, schema_name):
+        self._update_schema_state(schema_name=schema_name)
+
+    @property
+    def include_public_schema(self):
+        return self._get_schema_state().include_public
+
+    @include_public_schema.setter
+    def include_public_schema(self, include_public):
+        self._update_schema_state(include_public=include_public)
 
     def set_tenant(self, tenant, include_public=True):
         """
         Main API method to current database schema,
         but it does not actually modify the db connection.
         """
-        self.tenant = tenant
-        self._set_schema(tenant.schema_name, include_public)
+        self._set_schema(tenant.schema_name, include_public, tenant)
+
+    def set_tenant_lazy(self, resolve, include_public=True):
+        """
+        Stays in the public schema until the tenant is needed, that is when a
+        cursor is opened or connection.tenant or connection.schema_name is
+        read. ``resolve()`` is called then and must return the tenant.
+        """
+        self.set_schema_to_public()
+        self._update_schema_state(pending_tenant=(resolve, include_public))
+
+    def activate_pending_tenant(self):
+        pending = self._get_schema_state().pending_tenant
+        if pending is None:
+            return
+        resolve, include_public = pending
+        # resolve() runs its own queries in the public schema. If it fails the
+        # connection stays there, so the error is only raised once and the
+        # cursors of the error handling still work.
+        self._update_schema_state(pending_tenant=None)
+        tenant = resolve()
+        self.set_tenant(tenant, include_public)
 
     def set_schema(self, schema_name, include_public=True):
         """
         Main API method to current database schema,
         but it does not actually modify the db connection.
         """
-        self.tenant = FakeTenant(schema_name=schema_name)
-        self._set_schema(schema_name, include_public)
+        self._set_schema(schema_name, include_public, _get_fake_tenant(schema_name))
 
     def set_schema_to_public(self):
         """
         Instructs to stay in the common 'public' schema.
         """
-        self.tenant = FakeTenant(schema_name=get_public_schema_name())
-        self._set_schema(get_public_schema_name())
+        public_schema_name = get_public_schema_name()
+        self._set_schema(public_schema_name, True, _get_fake_tenant(public_schema_name))
 
     def set_settings_schema(self, schema_name, include_public=True):
         self.settings_dict['SCHEMA'] = [schema_name]  # should not be getting set to public when not necessary
         if include_public and schema_name != get_public_schema_name():
             self.settings_dict['SCHEMA'].append(get_public_schema_name())
 
-    def _set_schema(self, schema_name, include_public=True):
-        self.schema_name = schema_name
-        self.include_public_schema = include_public
+    def _set_schema(self, schema_name, include_public, tenant):
+        self._update_schema_state(tenant=tenant, schema_name=schema_name, include_public=include_public,
+                                  pending_tenant=None)
         self.set_settings_schema(schema_name, include_public)
         self.search_path_set = False
+        self._add_search_path_stats(tenant_switches=1)
+        self._switch_to_pooled_connection()
+
+    def _add_search_path_stats(self, **counters):
+        self.search_path_stats.add(**counters)
+        process_stats.add(**counters)
+
+    def _search_path_changed(self, search_path, duration=None):
+        """
+        Called after a SET search_path was sent, ``duration`` is None when it
+        was sent together with another statement.
+        """
+        self._add_search_path_stats(search_path_sets=1, search_path_time=duration or 0.0)
+        search_path_changed.send(sender=self.__class__, connection=self,
+                                 search_path=search_path, duration=duration)
+
+    def _get_current_search_path(self):
+        # Also called while connecting, so it must not resolve a pending tenant
+        state = self._get_schema_state()
+        if not state.schema_name:
+            return None
+        try:
+            return _get_search_path(state.schema_name, state.include_public, get_public_schema_name())
+        except ValidationError:
+            return None
+
+    def _switch_to_pooled_connection(self):
+        """
+        When pooling with TENANT_CONNECTION_POOL_SWITCH, trade the current
+        connection for an idle one that is already on the new schema. Only
+        done outside of transactions and when no cursor is open on the
+        current connection. The session state of the current connection
+        (temporary tables, advisory locks, settings) is discarded, hence
+        opt-in.
+        """
+        if not get_connection_pool_switch():
+            return
+        pool = get_connection_pool()
+        if pool is None or self.connection is None or self._pool_key is None:
+            return
+        if self.in_atomic_block or not self.autocommit or not self._is_poolable():
+            return
+        search_path = self._get_current_search_path()
+        if search_path is None or search_path == self.search_path_applied:
+            return
+        if pool.has(self._pool_key, search_path):
+            # returns the current connection to the pool, the next cursor
+            # will pick up the one on the right schema
+            self.close()
 
     def get_schema(self):
         warnings.warn("connection.get_schema() is deprecated, use connection.schema_name instead.",
@@ -113,53 +382,201 @@ class DatabaseWrapper(original_backend.DatabaseWrapper):
         Here it happens. We hope every Django db operation using PostgreSQL
         must go through this to get the cursor handle. We change the path.
         """
+        self.activate_pending_tenant()
+
         if name:
             # Only supported and required by Django 1.11 (server-side cursor)
             cursor = super(DatabaseWrapper, self)._cursor(name=name)
         else:
             cursor = super(DatabaseWrapper, self)._cursor()
 
+        if self.schema_qualified_query and get_schema_qualified_sql():
+            # The ORM statement names every table with its schema
+            return cursor
+
+        local = get_local_search_path()
+
+        # Actual search_path modification for the cursor. Database will
+        # search schemata from left to right when looking for the object
+        # (table, index, sequence, etc.).
+        if not self.schema_name:
+            raise ImproperlyConfigured("Database schema not set. Did you forget "
+                                       "to call set_schema() or set_tenant()?")
+        search_path = _get_search_path(self.schema_name, self.include_public_schema,
+                                       get_public_schema_name())
+
         # optionally limit the number of executions - under load, the execution
         # of `set search_path` can be quite time consuming
-        if (not get_limit_set_calls()) or not self.search_path_set:
-            # Actual search_path modification for the cursor. Database will
-            # search schemata from left to right when looking for the object
-            # (table, index, sequence, etc.).
-            if not self.schema_name:
-                raise ImproperlyConfigured("Database schema not set. Did you forget "
-                                           "to call set_schema() or set_tenant()?")
-            _check_schema_name(self.schema_name)
-            public_schema_name = get_public_schema_name()
-
-            if self.schema_name == public_schema_name:
-                search_paths = [protect_case(public_schema_name)]
-            elif self.include_public_schema:
-                search_paths = [protect_case(self.schema_name), protect_case(public_schema_name)]
-            else:
-                search_paths = [protect_case(self.schema_name)]
+        if (get_limit_set_calls() or local or name) and search_path == self.search_path_applied:
+            # The live connection (or with SET LOCAL, the current transaction)
+            # already uses this search_path, no need for another round trip.
+            # Compared on every cursor rather than trusting search_path_set, as
+            # coroutines with different tenants may share the connection.
+            # Always checked for server-side cursors, which are typically
+            # opened for every chunk of a QuerySet.iterator() loop.
+            self.search_path_set = True
+            self._add_search_path_stats(search_path_skips=1)
+            return cursor
+
+        if not name and (local or get_piggyback_search_path()):
+            # Send the SET in the same query string as the first statement
+            # executed on the cursor, saving a round trip. Named cursors
+            # wrap their query in DECLARE so they can't do this.
+            return SearchPathCursor(cursor, self, search_path, local=local)
+
+        if name:
+            # Named cursor can only be used once, use a plain cursor kept
+            # open on the connection instead
+            cursor_for_search_path = self._get_search_path_cursor()
+        else:
+            # Reuse
+            cursor_for_search_path = cursor
+
+        # In the event that an error already happened in this transaction and we are going
+        # to rollback we should just ignore database error when setting the search_path
+        # if the next instruction is not a rollback it will just fail also, so
+        # we do not have to worry that it's not the good one
+        #
+        # SET LOCAL has no effect outside of a transaction, so a server-side
+        # cursor used in autocommit mode falls back to a session level SET.
+        in_transaction = not self.autocommit
+        if local and in_transaction:
+            set_search_path_sql = 'SET LOCAL search_path = %s'
+        else:
+            set_search_path_sql = 'SET search_path = %s'
+        started = time.time()
+        try:
+            cursor_for_search_path.execute(set_search_path_sql, (AsIs(search_path),))
+        except (django.db.utils.DatabaseError, psycopg2.InternalError):
+            self.search_path_set = False
+            self.search_path_applied = None
+        else:
+            self.search_path_set = True
+            if not local or in_transaction:
+                self.search_path_applied = search_path
+            self._search_path_changed(search_path, time.time() - started)
+        return cursor
 
-            search_paths.extend([protect_case(extra_path) for extra_path in EXTRA_SEARCH_PATHS])
+    def _get_search_path_cursor(self):
+        cursor = self._search_path_cursor
+        if cursor is None or cursor.closed or cursor.connection is not self.connection:
+            cursor = self._search_path_cursor = self.connection.cursor()
+        return cursor
 
-            if name:
-                # Named cursor can only be used once
-                cursor_for_search_path = self.connection.cursor()
-            else:
-                # Reuse
-                cursor_for_search_path = cursor
 
-            # In the event that an error already happened in this transaction and we are going
-            # to rollback we should just ignore database error when setting the search_path
-            # if the next instruction is not a rollback it will just fail also, so
-            # we do not have to worry that it's not the good one
-            try:
-                cursor_for_search_path.execute('SET search_path = %s', (AsIs(','.join(search_paths)),))
-            except (django.db.utils.DatabaseError, psycopg2.InternalError):
-                self.search_path_set = False
+class SearchPathCursor(object):
+    """
+    Wraps a psycopg2 cursor and prepends the pending ``SET search_path`` to
+    the first statement executed on it, so both travel in a single round trip.
+
+    With ``local`` the path is set with ``SET LOCAL``. In autocommit mode every
+    statement is its own transaction, so every statement gets the prefix. The
+    path is kept on the cursor and sent again whenever the connection lost it,
+    for instance after the transaction it was set in ended.
+    """
+    def __init__(self, cursor, db, search_path, local=False):
+        self.cursor = cursor
+        self.db = db
+        self.search_path = search_path
+        self.local = local
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # Like Django's CursorWrapper, an error on close must not hide the
+        # original exception
+        try:
+            self.close()
+        except self.db.Database.Error:
+            pass
+
+    def _set_search_path_sql(self):
+        if self.local:
+            return 'SET LOCAL search_path = %s; ' % self.search_path
+        return 'SET search_path = %s; ' % self.search_path
+
+    def _per_statement(self):
+        return self.local and self.db.autocommit
+
+    def _needs_search_path(self):
+        return self._per_statement() or self.search_path != self.db.search_path_applied
+
+    def _applied(self):
+        self.db._search_path_changed(self.search_path)
+        if not self._per_statement():
+            self.db.search_path_applied = self.search_path
+
+    def execute(self, sql, params=None):
+        if not self._needs_search_path():
+            return self.cursor.execute(sql, params)
+        try:
+            result = self.cursor.execute(self._set_search_path_sql() + sql, params)
+        except Exception:
+            self.db.search_path_applied = None
+            raise
+        self._applied()
+        return result
+
+    def executemany(self, sql, param_list):
+        if self._needs_search_path():
+            if self._per_statement():
+                self.db._search_path_changed(self.search_path)
+                return self.cursor.executemany(self._set_search_path_sql() + sql, param_list)
+            self.cursor.execute(self._set_search_path_sql())
+            self._applied()
+        return self.cursor.executemany(sql, param_list)
+
+    def callproc(self, procname, params=None):
+        if self._per_statement():
+            # Same statement psycopg2 builds for callproc, with the prefix
+            if isinstance(params, Mapping):
+                arguments = ','.join('"%s" := %%(%s)s' % (name.replace('"', '""'), name) for name in params)
             else:
-                self.search_path_set = True
-            if name:
-                cursor_for_search_path.close()
-        return cursor
+                arguments = ','.join(['%s'] * len(params or ()))
+            self.execute('SELECT * FROM %s(%s)' % (procname, arguments), params)
+            return params
+        if self._needs_search_path():
+            self.cursor.execute(self._set_search_path_sql())
+            self._applied()
+        return self.cursor.callproc(procname, params)
+
+    def _copy(self, method, *args, **kwargs):
+        # COPY can't share its query string, the SET is sent on its own
+        if not self._needs_search_path():
+            return method(*args, **kwargs)
+        if not self._per_statement():
+            self.cursor.execute(self._set_search_path_sql())
+            self._applied()
+            return method(*args, **kwargs)
+        # SET LOCAL needs a transaction, run the COPY in one of its own
+        self.cursor.execute('BEGIN; ' + self._set_search_path_sql())
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            try:
+                self.cursor.execute('ROLLBACK')
+            except self.db.Database.Error:
+                pass
+            raise
+        self.cursor.execute('COMMIT')
+        self.db._search_path_changed(self.search_path)
+        return result
+
+    def copy_expert(self, *args, **kwargs):
+        return self._copy(self.cursor.copy_expert, *args, **kwargs)
+
+    def copy_from(self, *args, **kwargs):
+        return self._copy(self.cursor.copy_from, *args, **kwargs)
+
+    def copy_to(self, *args, **kwargs):
+        return self._copy(self.cursor.copy_to, *args, **kwargs)
 
 
 class FakeTenant:
@@ -167,5 +584,7 @@ class FakeTenant:
     We can't import any db model in a backend (apparently?), so this class is used
     for wrapping schema names in a tenant-like structure.
     """
+    __slots__ = ('schema_name',)
+
     def __init__(self, schema_name):
         self.schema_name = schema_name
@@ -0,0 +1,159 @@
+from functools import lru_cache
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db.models.expressions import Subquery
+from django.db.models.sql.datastructures import BaseTable, Join
+from django.db.models.sql.query import Query
+
+from django_tenants.utils import get_public_schema_name, protect_case
+
+
+@lru_cache(maxsize=None)
+def _get_table_apps(shared_apps, tenant_apps):
+    """
+    Maps every model table to (is_shared, is_tenant), using the same app
+    classification as TenantSyncRouter.
+    """
+    from django_tenants.routers import TenantSyncRouter
+
+    router = TenantSyncRouter()
+    tables = {}
+    for model in django_apps.get_models(include_auto_created=True):
+        app_label = model._meta.app_label
+        tables[model._meta.db_table] = (router.app_in_list(app_label, shared_apps),
+                                        router.app_in_list(app_label, tenant_apps))
+    return tables
+
+
+def get_table_schema_name(table_name, schema_name):
+    """
+    Returns the schema a model table lives in while ``schema_name`` is
+    active, or None if the table does not belong to a shared or tenant app.
+    """
+    tables = _get_table_apps(tuple(getattr(settings, 'SHARED_APPS', ())),
+                             tuple(getattr(settings, 'TENANT_APPS', ())))
+    try:
+        is_shared, is_tenant = tables[table_name]
+    except KeyError:
+        return None
+    public_schema_name = get_public_schema_name()
+    if is_tenant and schema_name != public_schema_name:
+        return schema_name
+    if is_shared or is_tenant:
+        return public_schema_name
+    return None
+
+
+class SchemaQualifiedCompilerMixin(object):
+    """
+    Emits "schema"."table" for model tables in FROM, JOIN, INSERT, UPDATE and
+    DELETE clauses, so the statement does not depend on the search_path.
+    Columns keep referring to the bare table name, which PostgreSQL resolves
+    against the qualified table.
+
+    Tables of apps in neither SHARED_APPS nor TENANT_APPS can't be qualified,
+    statements using them are executed with the search_path.
+    """
+    # Schema used for tenant tables, defaults to connection.schema_name
+    tenant_schema_name = None
+    has_unqualified_tables = False
+    # Subqueries are compiled by compilers of their own, which don't know
+    # about tenant_schema_name
+    has_subqueries = False
+    _qualify_table_names = False
+
+    def get_tenant_schema_name(self):
+        return self.tenant_schema_name or self.connection.schema_name
+
+    def qualify_table_name(self, table_name):
+        quoted = self.connection.ops.quote_name(table_name)
+        schema_name = get_table_schema_name(table_name, self.get_tenant_schema_name())
+        if schema_name is None:
+            # as_sql() runs before the cursor is opened, which then sets
+            # the search_path
+            self.has_unqualified_tables = True
+            self.connection.schema_qualified_query = False
+            return quoted
+        return '%s.%s' % (protect_case(schema_name), quoted)
+
+    def is_schema_qualified(self):
+        """
+        Returns False if the statement is known to need the search_path
+        before as_sql() is called.
+        """
+        return True
+
+    def compile(self, node, *args, **kwargs):
+        if isinstance(node, (Query, Subquery)):
+            self.has_subqueries = True
+        previous = self._qualify_table_names
+        self._qualify_table_names = isinstance(node, (BaseTable, Join))
+        try:
+            return super(SchemaQualifiedCompilerMixin, self).compile(node, *args, **kwargs)
+        finally:
+            self._qualify_table_names = previous
+
+    def quote_name_unless_alias(self, name):
+        if self._qualify_table_names and name in self.query.table_map:
+            return self.qualify_table_name(name)
+        return super(SchemaQualifiedCompilerMixin, self).quote_name_unless_alias(name)
+
+    def _qualify_statement(self, sql, prefix, table_name):
+        quoted = prefix + self.connection.ops.quote_name(table_name)
+        if sql.startswith(quoted):
+            sql = prefix + self.qualify_table_name(table_name) + sql[len(quoted):]
+        return sql
+
+    def execute_sql(self, *args, **kwargs):
+        # Tell the backend that this statement does not need the search_path
+        previous = self.connection.schema_qualified_query
+        self.connection.schema_qualified_query = self.is_schema_qualified()
+        try:
+            return super(SchemaQualifiedCompilerMixin, self).execute_sql(*args, **kwargs)
+        finally:
+            self.connection.schema_qualified_query = previous
+
+
+class SchemaQualifiedInsertCompilerMixin(SchemaQualifiedCompilerMixin):
+    def is_schema_qualified(self):
+        # The cursor is opened before as_sql() is called
+        return get_table_schema_name(self.query.get_meta().db_table, self.get_tenant_schema_name()) is not None
+
+    def as_sql(self):
+        table_name = self.query.get_meta().db_table
+        return [(self._qualify_statement(sql, 'INSERT INTO ', table_name), params)
+                for sql, params in super(SchemaQualifiedInsertCompilerMixin, self).as_sql()]
+
+
+class SchemaQualifiedDeleteCompilerMixin(SchemaQualifiedCompilerMixin):
+    def as_sql(self):
+        sql, params = super(SchemaQualifiedDeleteCompilerMixin, self).as_sql()
+        return self._qualify_statement(sql, 'DELETE FROM ', self.query.base_table), params
+
+
+class SchemaQualifiedUpdateCompilerMixin(SchemaQualifiedCompilerMixin):
+    def as_sql(self):
+        sql, params = super(SchemaQualifiedUpdateCompilerMixin, self).as_sql()
+        if not sql:
+            return sql, params
+        return self._qualify_statement(sql, 'UPDATE ', self.query.base_table), params
+
+
+COMPILER_MIXINS = {
+    'SQLInsertCompiler': SchemaQualifiedInsertCompilerMixin,
+    'SQLDeleteCompiler': SchemaQualifiedDeleteCompilerMixin,
+    'SQLUpdateCompiler': SchemaQualifiedUpdateCompilerMixin,
+}
+
+
+@lru_cache(maxsize=None)
+def schema_qualified_compiler(compiler_class):
+    """
+    Returns a subclass of the given SQL compiler class that emits
+    schema qualified table names.
+    """
+    if issubclass(compiler_class, SchemaQualifiedCompilerMixin):
+        return compiler_class
+    mixin = COMPILER_MIXINS.get(compiler_class.__name__, SchemaQualifiedCompilerMixin)
+    return type('SchemaQualified' + compiler_class.__name__, (mixin, compiler_class), {})
@@ -0,0 +1,114 @@
+import os
+import threading
+
+import psycopg2
+from django.conf import settings
+
+
+class SchemaConnectionPool(object):
+    """
+    Process wide pool of idle psycopg2 connections. Every connection remembers
+    the search_path that is applied on it, so a connection already pointing at
+    the wanted schema (and with its catalog cache warm on the server) can be
+    preferred when handing out connections.
+
+    Connections inherited by a forked child are never handed out, the parent
+    is still using them.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._pid = os.getpid()
+        self._inherited = []
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # Closing them would terminate the sessions of the parent, so the
+            # connections are only kept referenced and never used again
+            self._inherited.append(self._idle)
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def acquire(self, key, search_path=None):
+        """
+        Returns an idle ``(connection, search_path)`` for the given connection
+        parameters, preferring one on ``search_path``, or ``(None, None)``.
+        """
+        while True:
+            connection, applied = self._pop(key, search_path)
+            if connection is None or self._is_alive(connection):
+                return connection, applied
+            connection.close()
+
+    @staticmethod
+    def _is_alive(connection):
+        # psycopg2 only marks a connection closed after an operation failed on
+        # it, so one dropped by a server restart or a failover must be asked
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _pop(self, key, search_path):
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.get(key, [])
+            # drop connections closed by the server in the meantime
+            idle[:] = [item for item in idle if not item[0].closed]
+            if not idle:
+                return None, None
+            for idx in range(len(idle) - 1, -1, -1):
+                if idle[idx][1] == search_path:
+                    return idle.pop(idx)
+            return idle.pop()
+
+    def has(self, key, search_path):
+        with self._lock:
+            self._check_pid()
+            return any(applied == search_path for _, applied in self._idle.get(key, []))
+
+    def release(self, key, connection, search_path):
+        """
+        Puts a connection back into the pool. Returns False if the pool is full
+        and the connection should be closed instead.
+        """
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.setdefault(key, [])
+            if len(idle) >= self.max_idle:
+                return False
+            idle.append((connection, search_path))
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._check_pid()
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    """
+    Returns the process wide pool, or None if TENANT_CONNECTION_POOL_SIZE is
+    not set.
+    """
+    global _pool
+
+    max_idle = getattr(settings, 'TENANT_CONNECTION_POOL_SIZE', 0)
+    if not max_idle:
+        return None
+    if _pool is None or _pool.max_idle != max_idle:
+        with _pool_lock:
+            if _pool is None or _pool.max_idle != max_idle:
+                _pool = SchemaConnectionPool(max_idle)
+    return _pool
@@ -0,0 +1,55 @@
+import threading
+
+
+class SearchPathStats(object):
+    """
+    Counters about tenant switches and the search_path statements they cause.
+
+    * ``tenant_switches``: calls to set_tenant, set_schema and set_schema_to_public
+    * ``search_path_sets``: SET search_path statements sent to the database
+    * ``search_path_skips``: cursors that did not need a SET, as the search_path
+      was already applied
+    * ``search_path_time``: seconds spent in SET search_path statements that
+      were sent on their own (piggybacked ones can't be timed separately)
+    """
+    fields = ('tenant_switches', 'search_path_sets', 'search_path_skips', 'search_path_time')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.tenant_switches = 0
+            self.search_path_sets = 0
+            self.search_path_skips = 0
+            self.search_path_time = 0.0
+
+    def add(self, tenant_switches=0, search_path_sets=0, search_path_skips=0, search_path_time=0.0):
+        with self._lock:
+            self.tenant_switches += tenant_switches
+            self.search_path_sets += search_path_sets
+            self.search_path_skips += search_path_skips
+            self.search_path_time += search_path_time
+
+    def as_dict(self):
+        with self._lock:
+            return {field: getattr(self, field) for field in self.fields}
+
+
+# Totals of all the connections of this process
+process_stats = SearchPathStats()
+
+
+def get_search_path_stats(connection=None):
+    """
+    Returns the counters of a connection, or of the whole process when no
+    connection is given, as a dict.
+    """
+    if connection is not None:
+        return connection.search_path_stats.as_dict()
+    return process_stats.as_dict()
+
+
+def reset_search_path_stats():
+    process_stats.reset()
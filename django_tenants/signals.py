@@ -14,3 +14,9 @@ post_schema_migrate = Signal(providing_args=['tenant'])
 post_schema_migrate.__doc__ = """
 Sent after migrations have been run on a tenant.
 """
+
+search_path_changed = Signal(providing_args=['connection', 'search_path', 'duration'])
+search_path_changed.__doc__ = """
+Sent after a SET search_path was sent to the database. ``duration`` is the time
+the statement took in seconds, or None when it was sent along with another one.
+"""
@@ -1,15 +1,36 @@
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipIf
+
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import connection, transaction
-from django.test.utils import override_settings
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.functional import SimpleLazyObject
 
 from dts_test_app.models import DummyModel, ModelWithFkToPublicUser
 from django_tenants.test.cases import TenantTestCase
 from django_tenants.tests.testcases import BaseTestCase
 from django_tenants.utils import tenant_context, schema_context, schema_exists, get_tenant_model, get_public_schema_name, \
-    get_tenant_domain_model
+    get_tenant_domain_model, union_all_schemas, run_in_tenants
+
+from django_tenants.contenttypes import SchemaPartitionedCache
+from django_tenants.migration_executors import ReplayExecutor, get_executor
+from django_tenants.migration_executors.base import MigrationResult
+from django_tenants.postgresql_backend.pool import SchemaConnectionPool, get_connection_pool
+from django_tenants.postgresql_backend.stats import get_search_path_stats
 
-from django_tenants.migration_executors import get_executor
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
 
 
 class TenantDataAndSettingsTest(BaseTestCase):
@@ -187,6 +208,309 @@ class TenantDataAndSettingsTest(BaseTestCase):
 
         self.created = [domain2, domain1, tenant2, tenant1]
 
+    @override_settings(TENANT_PIGGYBACK_SEARCH_PATH=True)
+    def test_piggyback_search_path(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.set_tenant(tenant)
+        DummyModel(name="Schemas are").save()
+        connection.set_schema_to_public()
+
+        # the SET travels in the same query string as the count
+        connection.set_tenant(tenant)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(1, DummyModel.objects.count())
+        self.assertEqual(1, len(context.captured_queries))
+        self.assertTrue(context.captured_queries[0]['sql'].startswith('SET search_path = "tenant1","public"; SELECT'))
+        raw_cursor = connection.connection.cursor()
+        raw_cursor.execute('SELECT current_schema()')
+        self.assertEqual('tenant1', raw_cursor.fetchone()[0])
+
+        # executemany() can't carry it, the SET is sent on its own
+        connection.set_schema_to_public()
+        connection.set_tenant(tenant)
+        with self.assertNumQueries(2):
+            with connection.cursor() as cursor:
+                cursor.executemany('INSERT INTO dts_test_app_dummymodel (name) VALUES (%s)',
+                                   [('awesome!',), ('Man,',)])
+        self.assertEqual(3, DummyModel.objects.count())
+
+        # nor can COPY, which must still run in the tenant
+        connection.set_schema_to_public()
+        connection.set_tenant(tenant)
+        with connection.cursor() as cursor:
+            cursor.copy_from(io.StringIO('is great!\n'), 'dts_test_app_dummymodel', columns=('name',))
+        self.assertEqual(4, DummyModel.objects.count())
+
+        connection.set_schema_to_public()
+        with self.assertNumQueries(1):
+            self.assertTrue(get_tenant_model().objects.filter(schema_name='tenant1').exists())
+
+        self.created = [tenant]
+
+    @override_settings(TENANT_LOCAL_SEARCH_PATH=True)
+    def test_local_search_path_outside_transaction(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.set_schema_to_public()
+        connection.ensure_connection()
+        connection.connection.cursor().execute('SET search_path = public')
+        connection.set_tenant(tenant)
+
+        # every statement is its own transaction and carries the SET LOCAL
+        with self.assertNumQueries(3):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT current_schema()')
+                self.assertEqual('tenant1', cursor.fetchone()[0])
+                cursor.execute('CREATE FUNCTION add_one(value integer) RETURNS integer '
+                               'AS $$ SELECT value + 1 $$ LANGUAGE sql')
+                cursor.execute('SELECT current_schema()')
+                self.assertEqual('tenant1', cursor.fetchone()[0])
+
+        with connection.cursor() as cursor:
+            cursor.callproc('add_one', [1])
+            self.assertEqual(2, cursor.fetchone()[0])
+            cursor.callproc('add_one', {'value': 2})
+            self.assertEqual(3, cursor.fetchone()[0])
+
+        # the session keeps its own search_path
+        self.assertIsNone(connection.search_path_applied)
+        raw_cursor = connection.connection.cursor()
+        raw_cursor.execute('SELECT current_schema()')
+        self.assertEqual('public', raw_cursor.fetchone()[0])
+
+        connection.set_schema_to_public()
+        self.created = [tenant]
+
+    @override_settings(TENANT_LOCAL_SEARCH_PATH=True)
+    def test_local_search_path_in_transaction(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.set_schema_to_public()
+        connection.ensure_connection()
+        connection.connection.cursor().execute('SET search_path = public')
+        connection.set_tenant(tenant)
+
+        with transaction.atomic():
+            # the SET LOCAL goes with the first statement of the transaction
+            with self.assertNumQueries(2):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT current_schema()')
+                    self.assertEqual('tenant1', cursor.fetchone()[0])
+                self.assertIsNotNone(connection.search_path_applied)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT current_schema()')
+                    self.assertEqual('tenant1', cursor.fetchone()[0])
+
+        # forgotten with the transaction
+        self.assertIsNone(connection.search_path_applied)
+        raw_cursor = connection.connection.cursor()
+        raw_cursor.execute('SELECT current_schema()')
+        self.assertEqual('public', raw_cursor.fetchone()[0])
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('CREATE FUNCTION add_one(value integer) RETURNS integer '
+                               'AS $$ SELECT value + 1 $$ LANGUAGE sql')
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.callproc('add_one', {'value': 1})
+                self.assertEqual(2, cursor.fetchone()[0])
+
+        # a cursor outliving its transaction sets the path again in the next
+        with connection.cursor() as cursor:
+            with transaction.atomic():
+                cursor.execute('SELECT current_schema()')
+                self.assertEqual('tenant1', cursor.fetchone()[0])
+            with transaction.atomic():
+                cursor.execute('SELECT current_schema()')
+                self.assertEqual('tenant1', cursor.fetchone()[0])
+            cursor.execute('SELECT current_schema()')
+            self.assertEqual('tenant1', cursor.fetchone()[0])
+
+        connection.set_schema_to_public()
+        self.created = [tenant]
+
+    @override_settings(TENANT_CONNECTION_POOL_SIZE=2)
+    def test_connection_pool_resets_session(self):
+        connection.close()
+        connection.set_schema_to_public()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                backend_pid = cursor.fetchone()[0]
+                cursor.execute("SET statement_timeout = '1234ms'")
+                cursor.execute('CREATE TEMPORARY TABLE pooled_temp (id integer)')
+            connection.close()
+
+            with connection.cursor() as cursor:
+                # the same server connection, without the session state
+                cursor.execute('SELECT pg_backend_pid()')
+                self.assertEqual(backend_pid, cursor.fetchone()[0])
+                cursor.execute('SHOW statement_timeout')
+                self.assertNotEqual('1234ms', cursor.fetchone()[0])
+                cursor.execute("SELECT to_regclass('pooled_temp')")
+                self.assertIsNone(cursor.fetchone()[0])
+                cursor.execute('SELECT current_schema()')
+                self.assertEqual('public', cursor.fetchone()[0])
+        finally:
+            connection.close()
+            get_connection_pool().clear()
+
+    @override_settings(TENANT_CONNECTION_POOL_SIZE=2, TENANT_CONNECTION_POOL_SWITCH=True)
+    def test_connection_pool_keeps_connection_with_open_cursor(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.close()
+        connection.set_schema_to_public()
+        other = connections[DEFAULT_DB_ALIAS].__class__(dict(connection.settings_dict), DEFAULT_DB_ALIAS)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                backend_pid = cursor.fetchone()[0]
+
+            # an idle connection on tenant1 in the pool
+            other.set_tenant(tenant)
+            with other.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                other_backend_pid = cursor.fetchone()[0]
+            other.close()
+
+            connection.set_schema_to_public()
+            server_side_cursor = connection.chunked_cursor()
+            server_side_cursor.execute('SELECT generate_series(1, 3)')
+            self.assertEqual((1,), server_side_cursor.fetchone())
+            raw_connection = connection.connection
+            connection.set_tenant(tenant)
+            self.assertIs(raw_connection, connection.connection)
+            self.assertEqual((2,), server_side_cursor.fetchone())
+            server_side_cursor.close()
+
+            # nothing open anymore, the pooled connection on tenant1 is used
+            connection.set_schema_to_public()
+            connection.set_tenant(tenant)
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                self.assertEqual(other_backend_pid, cursor.fetchone()[0])
+
+            # the first connection is pooled on public now, but not taken
+            # inside of a transaction
+            with transaction.atomic():
+                connection.set_schema_to_public()
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_backend_pid()')
+                    self.assertEqual(other_backend_pid, cursor.fetchone()[0])
+
+            # and taken once the transaction is over
+            connection.set_tenant(tenant)
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.set_schema_to_public()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                self.assertEqual(backend_pid, cursor.fetchone()[0])
+        finally:
+            connection.set_schema_to_public()
+            connection.close()
+            other.close()
+            get_connection_pool().clear()
+        self.created = [tenant]
+
+    @override_settings(TENANT_CONNECTION_POOL_SIZE=2)
+    def test_connection_pool_drops_dead_connections(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.close()
+        connection.set_schema_to_public()
+        other = connections[DEFAULT_DB_ALIAS].__class__(dict(connection.settings_dict), DEFAULT_DB_ALIAS)
+        try:
+            other.ensure_connection()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                backend_pid = cursor.fetchone()[0]
+            connection.close()
+
+            # like a server restart, psycopg2 doesn't notice until the
+            # connection is used
+            with other.cursor() as cursor:
+                cursor.execute('SELECT pg_terminate_backend(%s)', (backend_pid,))
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                self.assertNotEqual(backend_pid, cursor.fetchone()[0])
+
+            # an idle connection on tenant1 in the pool is not swapped in
+            # without TENANT_CONNECTION_POOL_SWITCH
+            other.set_tenant(tenant)
+            with other.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            other.close()
+            raw_connection = connection.connection
+            connection.set_tenant(tenant)
+            self.assertIs(raw_connection, connection.connection)
+        finally:
+            connection.set_schema_to_public()
+            connection.close()
+            other.close()
+            get_connection_pool().clear()
+        self.created = [tenant]
+
+    @skipIf(not hasattr(os, 'fork'), 'Requires os.fork()')
+    def test_connection_pool_not_shared_after_fork(self):
+        class IdleConnection(object):
+            closed = False
+
+            def cursor(self):
+                return mock.MagicMock()
+
+        pool = SchemaConnectionPool(2)
+        idle_connection = IdleConnection()
+        pool.release('default', idle_connection, 'public')
+
+        pid = os.fork()
+        if pid == 0:
+            # the child must not get the connection of its parent
+            os._exit(0 if pool.acquire('default', 'public') == (None, None) else 1)
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+        self.assertEqual((idle_connection, 'public'), pool.acquire('default', 'public'))
+
+    def test_server_side_cursor_search_path(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.set_tenant(tenant)
+        DummyModel(name="Schemas are").save()
+        DummyModel(name="awesome!").save()
+
+        connection.set_schema_to_public()
+        self.assertTrue(get_tenant_model().objects.filter(schema_name='tenant1').exists())
+        connection.set_tenant(tenant)
+        stats = get_search_path_stats(connection)
+
+        # the SET runs on a plain cursor kept open on the connection
+        self.assertEqual(2, len(list(DummyModel.objects.iterator())))
+        search_path_cursor = connection._search_path_cursor
+        self.assertIsNotNone(search_path_cursor)
+        # already on tenant1, no SET this time
+        self.assertEqual(2, len(list(DummyModel.objects.iterator())))
+
+        connection.set_schema_to_public()
+        self.assertEqual(1, len(list(get_tenant_model().objects.filter(schema_name='tenant1').iterator())))
+        connection.set_tenant(tenant)
+        self.assertEqual(2, len(list(DummyModel.objects.iterator())))
+        self.assertIs(search_path_cursor, connection._search_path_cursor)
+
+        new_stats = get_search_path_stats(connection)
+        self.assertEqual(stats['search_path_sets'] + 3, new_stats['search_path_sets'])
+        self.assertEqual(stats['search_path_skips'] + 1, new_stats['search_path_skips'])
+
+        connection.set_schema_to_public()
+        self.created = [tenant]
+
     @override_settings(TENANT_LIMIT_SET_CALLS=True)
     def test_switching_search_path_limited_calls(self):
         tenant1 = get_tenant_model()(schema_name='tenant1')
@@ -233,6 +557,830 @@ class TenantDataAndSettingsTest(BaseTestCase):
 
         self.created = [domain2, domain1, tenant2, tenant1]
 
+    @override_settings(TENANT_LIMIT_SET_CALLS=True)
+    def test_switching_search_path_limited_calls_same_schema(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        domain = get_tenant_domain_model()(tenant=tenant, domain='something.test.com')
+        domain.save()
+
+        connection.set_tenant(tenant)
+
+        # 1 set search path + 1 count
+        with self.assertNumQueries(2):
+            self.assertEqual(0, DummyModel.objects.count())
+
+        # going through public without using it keeps the applied search path
+        connection.set_schema_to_public()
+        connection.set_tenant(tenant)
+        stats = get_search_path_stats(connection)
+
+        # 1 count, the search path is already the right one
+        with self.assertNumQueries(1):
+            self.assertEqual(0, DummyModel.objects.count())
+
+        new_stats = get_search_path_stats(connection)
+        self.assertEqual(stats['search_path_sets'], new_stats['search_path_sets'])
+        self.assertEqual(stats['search_path_skips'] + 1, new_stats['search_path_skips'])
+
+        self.created = [domain, tenant]
+
+    @override_settings(TENANT_SCHEMA_QUALIFIED_SQL=True)
+    def test_schema_qualified_sql(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.set_tenant(tenant)
+        with CaptureQueriesContext(connection) as context:
+            dummy = DummyModel.objects.create(name='qualified')
+            DummyModel.objects.filter(pk=dummy.pk).update(name='still qualified')
+            self.assertEqual(['still qualified'], list(DummyModel.objects.values_list('name', flat=True)))
+            self.assertTrue(get_tenant_model().objects.filter(schema_name='tenant1').exists())
+            DummyModel.objects.filter(pk=dummy.pk).delete()
+
+        statements = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(5, len(statements))
+        self.assertFalse(any('search_path' in sql for sql in statements))
+        self.assertTrue(statements[0].startswith('INSERT INTO "tenant1"."dts_test_app_dummymodel"'))
+        self.assertTrue(statements[1].startswith('UPDATE "tenant1"."dts_test_app_dummymodel"'))
+        self.assertIn('FROM "tenant1"."dts_test_app_dummymodel"', statements[2])
+        self.assertIn('FROM "public"."customers_client"', statements[3])
+        self.assertIn('"tenant1"."dts_test_app_dummymodel"', statements[4])
+
+        # auth is in neither SHARED_APPS nor TENANT_APPS now, its tables are
+        # left alone and the search_path is set
+        with override_settings(TENANT_APPS=('dts_test_app', 'django.contrib.contenttypes')):
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(0, User.objects.count())
+        statements = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(2, len(statements))
+        self.assertIn('search_path', statements[0])
+        self.assertIn('FROM "auth_user"', statements[1])
+
+        connection.set_schema_to_public()
+        self.created = [tenant]
+
+    def test_union_all_schemas(self):
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        with tenant_context(tenant1):
+            DummyModel(name="Schemas are").save()
+        with tenant_context(tenant2):
+            DummyModel(name="Man,").save()
+            DummyModel(name="testing").save()
+
+        connection.set_schema_to_public()
+
+        # 1 set search path + 1 statement, for each of the 2 batches of schemas
+        with self.assertNumQueries(4):
+            rows = list(union_all_schemas(DummyModel.objects.values_list('name'),
+                                          ['tenant1', 'tenant2', 'tenant1'], batch_size=2))
+
+        # 1 row of tenant1, 2 of tenant2 and 1 of tenant1 again
+        self.assertEqual(4, len(rows))
+        self.assertEqual(['Man,', 'testing'],
+                         sorted(row[0] for schema_name, row in rows if schema_name == 'tenant2'))
+
+        with self.assertRaises(ValueError):
+            list(union_all_schemas(DummyModel.objects.filter(pk__in=DummyModel.objects.values('pk')),
+                                   ['tenant1', 'tenant2']))
+
+        self.created = [tenant2, tenant1]
+
+    def test_run_in_tenants(self):
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        connection.set_schema_to_public()
+
+        class Interrupted(BaseException):
+            pass
+
+        def count_dummies(tenant):
+            if tenant == 'tenant2':
+                raise ValueError('tenant2')
+            return connection.schema_name, DummyModel.objects.count()
+
+        results = {tenant: (result, error) for tenant, result, error in
+                   run_in_tenants(count_dummies, ['tenant1', 'tenant2'], workers=2)}
+        self.assertEqual((('tenant1', 0), None), results['tenant1'])
+        self.assertIsNone(results['tenant2'][0])
+        self.assertIsInstance(results['tenant2'][1], ValueError)
+
+        def interrupt(tenant):
+            raise Interrupted()
+
+        # not swallowed, nor waited for forever
+        with self.assertRaises(Interrupted):
+            list(run_in_tenants(interrupt, [tenant1, tenant2]))
+
+        with self.assertRaises(ValueError):
+            run_in_tenants(count_dummies, [tenant1], workers=0)
+
+        self.created = [tenant2, tenant1]
+
+    @override_settings(TENANT_USER_CACHE_TIMEOUT=60, TENANT_USER_CACHE_SIZE=2)
+    def test_user_tenant_cache(self):
+        from django_tenants.middleware.cache import get_tenant_cache
+
+        loaded = []
+
+        def load():
+            loaded.append(True)
+            return get_tenant_model().objects.get(schema_name=get_public_schema_name())
+
+        tenant_cache = get_tenant_cache()
+        tenant_cache.invalidate()
+        tenant = tenant_cache.get_or_load(1, load)
+        with self.assertNumQueries(0):
+            cached_tenant = tenant_cache.get_or_load(1, load)
+        self.assertEqual(tenant.pk, cached_tenant.pk)
+        # every caller gets a copy of its own
+        self.assertIsNot(tenant, cached_tenant)
+        self.assertEqual(1, len(loaded))
+
+        # users without tenant are remembered as well
+        self.assertIsNone(tenant_cache.get_or_load(2, lambda: None))
+        self.assertIsNone(tenant_cache.get_or_load(2, load))
+
+        # only the 2 most recently used users are kept
+        tenant_cache.get_or_load(3, load)
+        tenant_cache.get_or_load(1, load)
+        self.assertEqual(3, len(loaded))
+
+        # saving a tenant invalidates the cache
+        self.public_tenant.save()
+        tenant_cache.get_or_load(3, load)
+        self.assertEqual(4, len(loaded))
+
+    def test_content_types_cached_per_schema(self):
+        from django.contrib.contenttypes.models import ContentType
+
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        ContentType.objects.clear_cache()
+        with tenant_context(tenant1):
+            content_type = ContentType.objects.get_for_model(DummyModel)
+
+        # not cached for this schema yet, 1 set search path + 1 select
+        with tenant_context(tenant2):
+            with self.assertNumQueries(2):
+                ContentType.objects.get_for_model(DummyModel)
+
+        with tenant_context(tenant1):
+            with self.assertNumQueries(0):
+                self.assertEqual(content_type, ContentType.objects.get_for_model(DummyModel))
+
+        # ContentType.objects is copied again from the declared manager
+        ContentType._meta._expire_cache()
+        with tenant_context(tenant1):
+            with self.assertNumQueries(0):
+                self.assertEqual(content_type, ContentType.objects.get_for_model(DummyModel))
+
+        # only the most recently used schemas are kept
+        cache = SchemaPartitionedCache(1)
+        with tenant_context(tenant1):
+            cache.setdefault(connection.alias, {})
+        with tenant_context(tenant2):
+            cache.setdefault(connection.alias, {})
+            self.assertIn(connection.alias, cache)
+        with tenant_context(tenant1):
+            self.assertNotIn(connection.alias, cache)
+
+        self.created = [tenant2, tenant1]
+
+    def test_lazy_tenant_activation(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        resolved = []
+
+        def resolve():
+            resolved.append(tenant)
+            return tenant
+
+        connection.set_tenant_lazy(resolve)
+        self.assertEqual([], resolved)
+
+        # the first cursor activates the tenant
+        self.assertEqual(0, DummyModel.objects.count())
+        self.assertEqual([tenant], resolved)
+        self.assertEqual('tenant1', connection.schema_name)
+
+        # a failed resolve is raised once, then the public schema is used
+        from django.http import Http404
+
+        def fail():
+            raise Http404('No tenant')
+
+        connection.set_tenant_lazy(fail)
+        with self.assertRaises(Http404):
+            DummyModel.objects.count()
+        self.assertEqual(get_public_schema_name(), connection.schema_name)
+        self.assertTrue(get_tenant_model().objects.filter(schema_name='tenant1').exists())
+
+        self.created = [tenant]
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': os.path.join(tempfile.gettempdir(), 'django_tenants_tests')}})
+    def test_tenant_hint(self):
+        from django_tenants.middleware.cache import get_tenant_version, invalidate_tenant_cache, \
+            invalidate_tenant_cache_m2m, invalidate_tenant_cache_user
+        from django_tenants.middleware.main import TenantMainMiddleware
+
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.set_schema_to_public()
+        lookups = []
+
+        class HintedTenantMiddleware(TenantMainMiddleware):
+            TENANT_HINT = 'session'
+
+            def get_tenant(self, tenant_model, user):
+                lookups.append(user)
+                return tenant_model.objects.get(schema_name='tenant1')
+
+        def process_request():
+            request = RequestFactory().get('/')
+            request.user = User(pk=1, username='hinted')
+            request.session = session
+            HintedTenantMiddleware().process_request(request)
+            connection.set_schema_to_public()
+            return request.tenant
+
+        session = {}
+        self.assertEqual(tenant.pk, process_request().pk)
+        self.assertEqual(1, len(lookups))
+
+        # built from the hint without any query
+        with self.assertNumQueries(0):
+            hinted_tenant = process_request()
+        self.assertEqual(1, len(lookups))
+        self.assertEqual((tenant.pk, 'tenant1'), (hinted_tenant.pk, hinted_tenant.schema_name))
+        self.assertFalse(hinted_tenant._state.adding)
+
+        # a user moved to another tenant through a relation
+        version = get_tenant_version()
+        invalidate_tenant_cache_m2m(sender=User, action='pre_add')
+        invalidate_tenant_cache_user(sender=User, update_fields=frozenset(['last_login']))
+        self.assertEqual(version, get_tenant_version())
+        invalidate_tenant_cache_m2m(sender=User, action='post_add')
+        self.assertNotEqual(version, get_tenant_version())
+        process_request()
+        self.assertEqual(2, len(lookups))
+
+        invalidate_tenant_cache()
+        process_request()
+        self.assertEqual(3, len(lookups))
+
+        # the version must be seen by all processes
+        for backend in ('locmem.LocMemCache', 'dummy.DummyCache'):
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.' + backend}}):
+                with self.assertRaises(ImproperlyConfigured):
+                    HintedTenantMiddleware()
+
+        # hints are neither stored nor trusted without a version
+        with mock.patch('django_tenants.middleware.main.get_tenant_version', return_value=None):
+            session = {}
+            process_request()
+            process_request()
+        self.assertEqual(5, len(lookups))
+        self.assertEqual({}, session)
+
+        # saving a tenant doesn't depend on the cache
+        with mock.patch('django_tenants.middleware.cache.bump_tenant_version', side_effect=ConnectionError):
+            invalidate_tenant_cache()
+
+        self.created = [tenant]
+
+    @skipIf(contextvars is None, 'contextvars requires Python 3.7')
+    def test_tenant_kept_per_context(self):
+        connection.set_schema('tenant1')
+        context = contextvars.copy_context()
+        connection.set_schema_to_public()
+
+        # a copied context, like the one of a coroutine, keeps its own tenant
+        self.assertEqual('tenant1', context.run(lambda: connection.schema_name))
+        self.assertEqual(get_public_schema_name(), connection.schema_name)
+
+        # other connections of the same alias keep their own tenant
+        connection.set_schema('tenant1')
+        other = connection.copy()
+        self.assertEqual('tenant1', connection.schema_name)
+        other.set_schema('tenant2')
+        self.assertEqual('tenant1', connection.schema_name)
+        connection.set_schema_to_public()
+        self.assertEqual('tenant2', other.schema_name)
+
+    def test_main_middleware_get_tenant(self):
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import Http404
+        from django_tenants.middleware.main import TenantMainMiddleware
+
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.set_schema_to_public()
+
+        class UserTenantMiddleware(TenantMainMiddleware):
+            def get_user_tenant(self, tenant_model, user):
+                return tenant_model.objects.get(schema_name='tenant1')
+
+        middleware = UserTenantMiddleware()
+        request = RequestFactory().get('/')
+        request.user = User(pk=1, username='tenant_user')
+        middleware.process_request(request)
+        self.assertEqual(tenant.pk, request.tenant.pk)
+        self.assertEqual('tenant1', connection.schema_name)
+
+        connection.set_schema_to_public()
+        for user in (AnonymousUser(), User(pk=2, username='staff', is_staff=True), None):
+            with self.assertRaises(Http404):
+                middleware.get_tenant(get_tenant_model(), user)
+
+        self.created = [tenant]
+
+    def test_domain_index(self):
+        from django_tenants.middleware.domain import domain_index
+
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        domain = get_tenant_domain_model()(tenant=tenant, domain='*.tenant1.test.com')
+        domain.save()
+
+        connection.set_schema_to_public()
+        domain_index.clear()
+        self.assertEqual(tenant.pk, domain_index.get_tenant('a.b.tenant1.test.com').pk)
+
+        # loaded once, then resolved in memory
+        with self.assertNumQueries(0):
+            self.assertEqual(self.public_tenant.pk, domain_index.get_tenant('TEST.com').pk)
+            self.assertIsNone(domain_index.get_tenant('tenant1.test.com'))
+
+        # kept up to date by the signals
+        domain.delete()
+        self.assertIsNone(domain_index.get_tenant('a.tenant1.test.com'))
+
+        # changes made by other processes are seen through the tenant version
+        from django_tenants.middleware.cache import bump_tenant_version
+
+        domain_index.get_tenant('test.com')
+        bump_tenant_version()
+        with self.assertNumQueries(0):
+            domain_index.get_tenant('test.com')
+        with override_settings(TENANT_DOMAIN_INDEX_CHECK_INTERVAL=0):
+            with self.assertNumQueries(1):
+                domain_index.get_tenant('test.com')
+
+        self.created = [tenant]
+
+    def test_fallback_tenant_cached(self):
+        from django_tenants.middleware.cache import get_fallback_tenant
+
+        get_fallback_tenant(get_tenant_model(), get_public_schema_name())
+        with self.assertNumQueries(0):
+            tenant = get_fallback_tenant(get_tenant_model(), get_public_schema_name())
+        self.assertEqual(self.public_tenant.pk, tenant.pk)
+
+    def test_metrics_middleware(self):
+        from django.http import HttpResponse
+        from django_tenants.middleware.metrics import TenantMetricsMiddleware, tenant_metrics
+
+        flushed = []
+
+        def handler(started, ended, schemas):
+            flushed.append(schemas)
+
+        tenant_metrics.snapshot(reset=True)
+        middleware = TenantMetricsMiddleware()
+        with override_settings(TENANT_METRICS_HANDLER=handler, TENANT_METRICS_FLUSH_INTERVAL=3600):
+            request = RequestFactory().get('/')
+            request.tenant = get_tenant_model()(schema_name='tenant1')
+            middleware.process_request(request)
+            with CaptureQueriesContext(connection) as context:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.execute('SELECT 2')
+            middleware.process_response(request, HttpResponse())
+
+            # a lazy tenant that was never resolved stayed on public
+            request = RequestFactory().get('/')
+            request.tenant = SimpleLazyObject(lambda: self.fail('resolved'))
+            middleware.process_request(request)
+            middleware.process_response(request, HttpResponse())
+
+            # nothing handed to the handler before the interval is over
+            self.assertEqual([], flushed)
+            tenant_metrics.flush(force=True)
+
+        self.assertEqual(1, len(flushed))
+        metrics = flushed[0]['tenant1']
+        self.assertEqual(1, metrics['requests'])
+        self.assertEqual(1, metrics['latency']['count'])
+        # the SET search_path is counted as well
+        self.assertEqual(len(context.captured_queries), metrics['queries']['sum'])
+        self.assertEqual(3, metrics['queries']['sum'])
+        self.assertEqual(0, flushed[0][get_public_schema_name()]['queries']['sum'])
+        self.assertEqual({}, tenant_metrics.snapshot()[2])
+
+    def test_schemas_to_migrate(self):
+        from django_tenants.migration_executors.base import get_schemas_to_migrate
+
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        connection.set_schema_to_public()
+
+        # up to date schemas are skipped, unknown ones dispatched
+        self.assertEqual(['tenant3'], get_schemas_to_migrate(['tenant1', 'tenant2', 'tenant3']))
+
+        # tenant2 misses the last migration of dts_test_app
+        with schema_context('tenant2'):
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM django_migrations WHERE app = 'dts_test_app' AND name = '0001_initial'")
+        self.assertEqual(['tenant2'], get_schemas_to_migrate(['tenant1', 'tenant2']))
+
+        # a squashed migration counts as applied when all the migrations it
+        # replaces are
+        leaves = {('dts_test_app', '0002_squashed'): (('dts_test_app', '0001_initial'),
+                                                      ('customers', '0001_initial'))}
+        with mock.patch('django_tenants.migration_executors.base.get_leaf_migrations', return_value=leaves):
+            self.assertEqual(['tenant2'], get_schemas_to_migrate(['tenant1', 'tenant2']))
+
+        self.created = [tenant2, tenant1]
+
+    def test_multiprocessing_executor(self):
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        # migrate fails to read the django_migrations table of tenant2
+        with schema_context('tenant2'):
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TABLE django_migrations')
+                cursor.execute('CREATE TABLE django_migrations (id integer)')
+
+        connection.set_schema_to_public()
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            # tenant1 is still migrated by the other worker
+            with self.assertRaisesRegex(CommandError, 'Migrations failed on 1 of 2 schemas: tenant2'):
+                call_command('migrate_schemas', tenant=True, executor='multiprocessing', skip_current=False,
+                             interactive=False, verbosity=0)
+        self.assertIn('[multiprocessing:tenant2] Migration failed', stderr.getvalue())
+        self.assertIn('django_migrations', stderr.getvalue())
+
+        self.created = [tenant2, tenant1]
+
+    def test_multiprocessing_executor_in_transaction(self):
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        connection.set_schema_to_public()
+        with schema_context('tenant1'):
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM django_migrations WHERE app = 'dts_test_app'")
+                cursor.execute('DROP TABLE dts_test_app_modelwithfktopublicuser, dts_test_app_dummymodel')
+
+        # no worker is forked with the connection of the transaction
+        with mock.patch('multiprocessing.Pool') as pool:
+            with transaction.atomic():
+                call_command('migrate_schemas', tenant=True, executor='multiprocessing', interactive=False,
+                             verbosity=0)
+        pool.assert_not_called()
+        with schema_context('tenant1'):
+            self.assertEqual(0, DummyModel.objects.count())
+
+        self.created = [tenant]
+
+    def test_connection_kept_across_schemas(self):
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+        from django_tenants.migration_executors.base import MigrateCommand
+
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        original_execute = MigrateCommand.execute
+        states = []
+
+        def execute(command, *args, **options):
+            with connection.cursor() as cursor:
+                cursor.execute('SHOW search_path')
+                search_path = cursor.fetchone()[0]
+                cursor.execute('SHOW statement_timeout')
+                statement_timeout = cursor.fetchone()[0]
+            states.append((connection.schema_name, connection.connection.get_backend_pid(), search_path,
+                           connection.in_atomic_block, connection.get_autocommit(),
+                           connection.connection.get_transaction_status(), statement_timeout))
+            # session state left by a migration, as RunSQL('SET ...') does
+            with connection.cursor() as cursor:
+                cursor.execute("SET statement_timeout = '1234ms'")
+            return original_execute(command, *args, **options)
+
+        connection.set_schema_to_public()
+        with mock.patch.object(MigrateCommand, 'execute', execute):
+            call_command('migrate_schemas', tenant=True, executor='standard', skip_current=False,
+                         interactive=False, verbosity=0)
+
+        # same backend, only the search_path changes, no transaction or
+        # session state left over
+        self.assertEqual(['tenant1', 'tenant2'], sorted(state[0] for state in states))
+        self.assertEqual(1, len({state[1] for state in states}))
+        for schema_name, pid, search_path, in_atomic_block, autocommit, status, statement_timeout in states:
+            self.assertEqual(schema_name, search_path)
+            self.assertNotEqual('1234ms', statement_timeout)
+            self.assertFalse(in_atomic_block)
+            self.assertTrue(autocommit)
+            self.assertEqual(TRANSACTION_STATUS_IDLE, status)
+
+        self.created = [tenant2, tenant1]
+
+    def test_migrations_resumed(self):
+        from django_tenants.migration_executors.base import MigrateCommand
+
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        original_execute = MigrateCommand.execute
+        migrated = []
+        interrupted = [True]
+
+        def execute(command, *args, **options):
+            schema_name = connection.schema_name
+            if schema_name != get_public_schema_name():
+                if interrupted[0] and migrated:
+                    raise RuntimeError('interrupted')
+                migrated.append(schema_name)
+            return original_execute(command, *args, **options)
+
+        journal_dir = tempfile.mkdtemp()
+        stdout = io.StringIO()
+        connection.set_schema_to_public()
+        with override_settings(TENANT_MIGRATION_JOURNAL=os.path.join(journal_dir, 'migrations.journal')):
+            with mock.patch.object(MigrateCommand, 'execute', execute), mock.patch('sys.stdout', new=io.StringIO()):
+                # public and the first tenant schema are migrated
+                with self.assertRaisesRegex(RuntimeError, 'interrupted'):
+                    call_command('migrate_schemas', executor='standard', skip_current=False, resume=True,
+                                 interactive=False, verbosity=1, stdout=stdout)
+                first_run = migrated[:]
+
+                connection.set_schema_to_public()
+                interrupted[0] = False
+                del migrated[:]
+                call_command('migrate_schemas', executor='standard', skip_current=False, resume=True,
+                             interactive=False, verbosity=1, stdout=stdout)
+
+        self.assertEqual(1, len(first_run))
+        self.assertIn('Resuming, skipping 1 of 2 tenant schemas already migrated', stdout.getvalue())
+        self.assertEqual({'tenant1', 'tenant2'} - set(first_run), set(migrated))
+
+        os.remove(os.path.join(journal_dir, 'migrations.journal'))
+        os.rmdir(journal_dir)
+
+        self.created = [tenant2, tenant1]
+
+    def test_migration_journal_path(self):
+        from django_tenants.utils import get_migration_journal_path
+
+        # one journal per database, not per alias
+        settings_dict = connection.settings_dict
+        with mock.patch.dict(settings_dict, {'HOST': 'db.example.com', 'PORT': '5433', 'NAME': 'my/project'}):
+            path = get_migration_journal_path()
+        self.assertEqual('django_tenants_migrations_db.example.com_5433_my_project.journal', os.path.basename(path))
+
+        with override_settings(TENANT_MIGRATION_JOURNAL='/var/lib/app/migrations.journal'):
+            self.assertEqual('/var/lib/app/migrations.journal', get_migration_journal_path())
+
+    def test_migration_files_loaded_once_by_threads(self):
+        from django.db.migrations.loader import MigrationLoader
+        from django_tenants.migration_executors.loader import CachedMigrationLoader, cached_migrations
+
+        original_load_disk = MigrationLoader.load_disk
+        running = []
+        calls = []
+
+        def load_disk(loader):
+            running.append(loader)
+            calls.append(len(running))
+            try:
+                time.sleep(0.05)
+                return original_load_disk(loader)
+            finally:
+                running.remove(loader)
+
+        with cached_migrations():
+            with mock.patch.object(MigrationLoader, 'load_disk', load_disk):
+                with ThreadPoolExecutor(max_workers=4) as pool:
+                    loaders = list(pool.map(lambda _: CachedMigrationLoader(None, ignore_no_migrations=True),
+                                            range(4)))
+        # read by one thread, the others waited for it
+        self.assertEqual([1], calls)
+        self.assertEqual(1, len(set(id(loader.graph) for loader in loaders)))
+
+    def test_migration_graph_shared_by_schemas(self):
+        from django.core.management.commands import migrate
+        from django_tenants.migration_executors.loader import CachedMigrationExecutor, cached_migrations, \
+            migration_cache
+
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        executors = []
+        plans = []
+        states = []
+        with cached_migrations():
+            self.assertIs(CachedMigrationExecutor, migrate.MigrationExecutor)
+            for schema_name in ('tenant1', 'tenant2'):
+                with schema_context(schema_name):
+                    executor = CachedMigrationExecutor(connection)
+                    targets = executor.loader.graph.leaf_nodes()
+                    executors.append(executor)
+                    plans.append(executor.migration_plan(targets, clean_start=True))
+                    states.append(executor._create_project_state(with_applied_migrations=True))
+            self.assertEqual(1, len(migration_cache.plans))
+
+        # the graph is built once, the plan and states are copies of the cached ones
+        self.assertIs(executors[0].loader.graph, executors[1].loader.graph)
+        self.assertEqual(plans[0], plans[1])
+        self.assertIsNot(plans[0], plans[1])
+        self.assertIsNot(states[0], states[1])
+        self.assertEqual(set(states[0].models), set(states[1].models))
+
+        # dropped once migrate is done
+        self.assertIsNot(CachedMigrationExecutor, migrate.MigrationExecutor)
+        self.assertEqual({}, migration_cache.graphs)
+
+        self.created = [tenant2, tenant1]
+
+    def test_replay_executor(self):
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        def unapply_dts_test_app():
+            for schema_name in ('tenant1', 'tenant2'):
+                with schema_context(schema_name):
+                    with connection.cursor() as cursor:
+                        cursor.execute("DELETE FROM django_migrations WHERE app = 'dts_test_app'")
+                        cursor.execute('DROP TABLE dts_test_app_modelwithfktopublicuser, dts_test_app_dummymodel')
+            connection.set_schema_to_public()
+
+        def assert_dts_test_app_applied():
+            for schema_name in ('tenant1', 'tenant2'):
+                with schema_context(schema_name):
+                    self.assertEqual(0, DummyModel.objects.count())
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT name FROM django_migrations WHERE app = 'dts_test_app'")
+                        self.assertEqual([('0001_initial',)], cursor.fetchall())
+            connection.set_schema_to_public()
+
+        # migrated on one schema, its SQL replayed on the other
+        unapply_dts_test_app()
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            call_command('migrate_schemas', tenant=True, executor='replay', interactive=False, verbosity=1)
+        self.assertIn('Applying 1 migrations to replay them on 1 more schemas', stdout.getvalue())
+        self.assertIn('Replaying 1 migrations', stdout.getvalue())
+        assert_dts_test_app_applied()
+
+        # the group is migrated as usual when the first schema fails
+        unapply_dts_test_app()
+        with mock.patch('django_tenants.migration_executors.replay.apply_and_collect_sql',
+                        side_effect=RuntimeError('first schema failed')):
+            with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                call_command('migrate_schemas', tenant=True, executor='replay', interactive=False, verbosity=0)
+        self.assertIn('Replay failed, running migrate on 2 schemas', stderr.getvalue())
+        self.assertIn('first schema failed', stderr.getvalue())
+        assert_dts_test_app_applied()
+
+        # as are the schemas whose replay fails
+        unapply_dts_test_app()
+        with mock.patch.object(ReplayExecutor, 'replay',
+                               side_effect=lambda schema_name, *args: MigrationResult(schema_name, False, 0, 'failed')):
+            with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                call_command('migrate_schemas', tenant=True, executor='replay', interactive=False, verbosity=0)
+        self.assertIn('[replay:tenant2] Replay failed, running migrate', stderr.getvalue())
+        assert_dts_test_app_applied()
+
+        self.created = [tenant2, tenant1]
+
+    def test_replay_non_ascii_default(self):
+        from django.db import migrations, models
+        from django.db.migrations.executor import MigrationExecutor
+        from django_tenants.migration_executors.replay import apply_and_collect_sql
+
+        tenant1 = get_tenant_model()(schema_name='tenant1')
+        tenant1.save()
+
+        connection.set_schema_to_public()
+
+        tenant2 = get_tenant_model()(schema_name='tenant2')
+        tenant2.save()
+
+        for schema_name in ('tenant1', 'tenant2'):
+            with schema_context(schema_name):
+                DummyModel(name='existing').save()
+
+        # the default of the existing rows is sent as a parameter
+        migration = migrations.Migration('0002_label', 'dts_test_app')
+        migration.operations = [migrations.AddField('dummymodel', 'label',
+                                                    models.CharField(max_length=10, default='Café 日本'))]
+        plan = [(migration, False)]
+        with schema_context('tenant1'):
+            executor = MigrationExecutor(connection)
+            statements, state = apply_and_collect_sql(executor, plan, executor.loader.project_state())
+        replay_executor = ReplayExecutor([], {'verbosity': 0, 'interactive': False})
+        result = replay_executor.replay('tenant2', plan, statements, state.apps, state.apps)
+        self.assertTrue(result.success, result.error)
+
+        for schema_name in ('tenant1', 'tenant2'):
+            with schema_context(schema_name):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT label FROM dts_test_app_dummymodel')
+                    self.assertEqual([('Café 日本',)], cursor.fetchall())
+
+        self.created = [tenant2, tenant1]
+
+    def test_replay_detects_python_code(self):
+        from django.db.migrations import Migration, RunPython, SeparateDatabaseAndState
+        from django.db.migrations.executor import MigrationExecutor
+        from django.db.migrations.operations.base import Operation
+        from django_tenants.migration_executors.replay import NotReplayable, apply_and_collect_sql, is_replayable
+
+        class UpdateDummyModels(Operation):
+            def state_forwards(self, app_label, state):
+                pass
+
+            def database_forwards(self, app_label, schema_editor, from_state, to_state):
+                to_state.apps.get_model('dts_test_app', 'DummyModel').objects.update(name='replayed')
+
+        tenant = get_tenant_model()(schema_name='tenant1')
+        tenant.save()
+
+        migration = Migration('0002_python', 'dts_test_app')
+        migration.operations = [SeparateDatabaseAndState(database_operations=[RunPython(lambda apps, editor: None)])]
+        self.assertFalse(is_replayable(migration))
+
+        # looks replayable, but writes through the ORM
+        migration.operations = [UpdateDummyModels()]
+        self.assertTrue(is_replayable(migration))
+        with schema_context('tenant1'):
+            DummyModel(name='original').save()
+            executor = MigrationExecutor(connection)
+            state = executor.loader.project_state()
+            with self.assertRaises(NotReplayable):
+                apply_and_collect_sql(executor, [(migration, False)], state)
+            self.assertEqual(['original'], list(DummyModel.objects.values_list('name', flat=True)))
+            self.assertNotIn(('dts_test_app', '0002_python'), executor.recorder.applied_migrations())
+
+        self.created = [tenant]
+
     def test_switching_tenant_without_previous_tenant(self):
         tenant = get_tenant_model()(schema_name='test')
         tenant.save()
@@ -1,3 +1,8 @@
+import os
+import re
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
 from django.conf import settings
 from django.db import connections, DEFAULT_DB_ALIAS, transaction
@@ -19,6 +24,10 @@ def get_tenant_model():
     return get_model(settings.TENANT_MODEL)
 
 
+def get_tenant_domain_model():
+    return get_model(settings.TENANT_DOMAIN_MODEL)
+
+
 def get_tenant_database_alias():
     return getattr(settings, 'TENANT_DB_ALIAS', DEFAULT_DB_ALIAS)
 
@@ -31,6 +40,74 @@ def get_limit_set_calls():
     return getattr(settings, 'TENANT_LIMIT_SET_CALLS', False)
 
 
+def get_piggyback_search_path():
+    return getattr(settings, 'TENANT_PIGGYBACK_SEARCH_PATH', False)
+
+
+def get_local_search_path():
+    return getattr(settings, 'TENANT_LOCAL_SEARCH_PATH', False)
+
+
+def get_schema_qualified_sql():
+    return getattr(settings, 'TENANT_SCHEMA_QUALIFIED_SQL', False)
+
+
+def get_connection_pool_switch():
+    return getattr(settings, 'TENANT_CONNECTION_POOL_SWITCH', False)
+
+
+def get_fanout_batch_size():
+    return getattr(settings, 'TENANT_FANOUT_BATCH_SIZE', 500)
+
+
+def get_migration_journal_path(database=None):
+    journal = getattr(settings, 'TENANT_MIGRATION_JOURNAL', None)
+    if journal:
+        return journal
+    # named after the database rather than the alias, which is the same in
+    # every project on the host
+    settings_dict = connections[database or get_tenant_database_alias()].settings_dict
+    name = '_'.join(str(settings_dict.get(key) or '') for key in ('HOST', 'PORT', 'NAME'))
+    return os.path.join(tempfile.gettempdir(),
+                        'django_tenants_migrations_%s.journal' % re.sub(r'[^A-Za-z0-9.-]', '_', name))
+
+
+def get_tenant_cache_timeout():
+    return getattr(settings, 'TENANT_USER_CACHE_TIMEOUT', 0)
+
+
+def get_tenant_cache_size():
+    return getattr(settings, 'TENANT_USER_CACHE_SIZE', 1024)
+
+
+def get_tenant_cache_alias():
+    return getattr(settings, 'TENANT_USER_CACHE_ALIAS', None)
+
+
+def get_content_type_cache_size():
+    return getattr(settings, 'TENANT_CONTENT_TYPE_CACHE_SIZE', 1024)
+
+
+def get_fallback_tenant_cache_timeout():
+    return getattr(settings, 'TENANT_FALLBACK_CACHE_TIMEOUT', 300)
+
+
+def get_domain_index_timeout():
+    return getattr(settings, 'TENANT_DOMAIN_INDEX_TIMEOUT', 300)
+
+
+def get_domain_index_check_interval():
+    return getattr(settings, 'TENANT_DOMAIN_INDEX_CHECK_INTERVAL', 5)
+
+
+def get_metrics_flush_interval():
+    return getattr(settings, 'TENANT_METRICS_FLUSH_INTERVAL', 60)
+
+
+def get_metrics_handler():
+    return getattr(settings, 'TENANT_METRICS_HANDLER', 'django_tenants.middleware.metrics.log_metrics')
+
+
 def get_clone_schema_owner():
     return getattr(settings, 'CLONE_SCHEMA_OWNER', 'postgres')
 
@@ -89,6 +166,121 @@ def tenant_context(tenant, include_public=True):
             connection.set_tenant(previous_tenant, previous_include_public)
 
 
+FANOUT_SCHEMA_PLACEHOLDER = '__django_tenants_schema__'
+
+
+def union_all_schemas(queryset, schema_names, batch_size=None):
+    """
+    Runs a queryset in every given schema, compiling it only once and
+    sending one ``UNION ALL`` statement per batch of schemas instead of one
+    query per schema. Yields ``(schema_name, row)`` tuples, ``row`` being the
+    raw database row of the queryset (e.g. of ``values_list()``). Values are
+    not converted by the model fields. Querysets with subqueries or with
+    tables of apps in neither SHARED_APPS nor TENANT_APPS raise ValueError.
+
+    Usage:
+        for schema_name, (count, ) in union_all_schemas(Order.objects.annotate(...)..., schemas):
+            ...
+    """
+    from django.core.exceptions import EmptyResultSet
+    from django_tenants.postgresql_backend.base import _check_schema_name
+    from django_tenants.postgresql_backend.compiler import schema_qualified_compiler
+
+    batch_size = batch_size or get_fanout_batch_size()
+    connection = connections[queryset.db]
+    compiler_class = schema_qualified_compiler(connection.ops.compiler(queryset.query.compiler))
+    compiler = compiler_class(queryset.query, connection, queryset.db)
+    compiler.tenant_schema_name = FANOUT_SCHEMA_PLACEHOLDER
+    try:
+        sql, params = compiler.as_sql()
+    except EmptyResultSet:
+        return
+    if compiler.has_subqueries:
+        raise ValueError("union_all_schemas() does not support querysets with subqueries.")
+    if compiler.has_unqualified_tables:
+        raise ValueError("union_all_schemas() only supports tables of the SHARED_APPS and TENANT_APPS.")
+
+    placeholder = protect_case(FANOUT_SCHEMA_PLACEHOLDER) + '.'
+    schema_names = list(schema_names)
+    for start in range(0, len(schema_names), batch_size):
+        statements = []
+        statement_params = []
+        for schema_name in schema_names[start:start + batch_size]:
+            _check_schema_name(schema_name)
+            statements.append('SELECT %s, "fanout".* FROM (' +
+                              sql.replace(placeholder, protect_case(schema_name) + '.') +
+                              ') "fanout"')
+            statement_params.append(schema_name)
+            statement_params.extend(params)
+
+        with connection.cursor() as cursor:
+            cursor.execute(' UNION ALL '.join(statements), statement_params)
+            for row in cursor.fetchall():
+                yield row[0], row[1:]
+
+
+TenantResult = namedtuple('TenantResult', ['tenant', 'result', 'error'])
+
+
+def run_in_tenants(func, tenants, workers=4):
+    """
+    Calls ``func(tenant)`` inside the schema of every tenant (tenant objects or
+    schema names), concurrently on ``workers`` threads. Every thread uses its
+    own database connection, kept open across tenants. Yields a
+    ``TenantResult(tenant, result, error)`` as soon as each tenant is done,
+    an exception raised by ``func`` is returned as ``error``. Other exceptions
+    such as ``KeyboardInterrupt`` are raised to the caller.
+
+    Usage:
+        for tenant, result, error in run_in_tenants(send_invoices, Client.objects.all(), workers=8):
+            ...
+    """
+    if workers < 1:
+        raise ValueError("run_in_tenants() needs at least 1 worker.")
+    return _run_in_tenants(func, list(tenants), workers)
+
+
+def _run_in_tenants(func, tenants, workers):
+    used_connections = set()
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(tenants))))
+    futures = [pool.submit(_run_in_tenant, func, tenant, used_connections) for tenant in tenants]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # stop handing out tenants if the caller stopped consuming results
+        for future in futures:
+            future.cancel()
+        pool.shutdown()
+        for connection in used_connections:
+            # the worker threads are done with it
+            connection.allow_thread_sharing = True
+            connection.close()
+
+
+def _run_in_tenant(func, tenant, used_connections):
+    # Connections are per thread, the ones of this thread are kept open for
+    # the next tenants and closed by run_in_tenants at the end
+    used_connections.update(connections.all())
+    connection = connections[get_tenant_database_alias()]
+    if isinstance(tenant, str):
+        context = schema_context(tenant)
+    else:
+        context = tenant_context(tenant)
+    try:
+        with context:
+            return TenantResult(tenant, func(tenant), None)
+    except Exception as e:
+        return TenantResult(tenant, None, e)
+    finally:
+        # Same check as Django does between requests
+        if connection.connection is not None and connection.errors_occurred:
+            if connection.is_usable():
+                connection.errors_occurred = False
+            else:
+                connection.close()
+
+
 def clean_tenant_url(url_string):
     """
     Removes the TENANT_TOKEN from a particular string
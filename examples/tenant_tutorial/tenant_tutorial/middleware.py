@@ -1,10 +1,10 @@
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
 from django.db import connection
 from django.http import Http404
 from django.utils.deprecation import MiddlewareMixin  # todo change
 
-from django_tenants.utils import remove_www_and_dev, get_public_schema_name, get_tenant_domain_model
+from django_tenants.middleware.domain import domain_index
+from django_tenants.utils import remove_www_and_dev, get_public_schema_name
 from django.db import utils
 
 
@@ -14,20 +14,19 @@ class TenantTutorialMiddleware(MiddlewareMixin):
         hostname_without_port = remove_www_and_dev(request.get_host().split(':')[0])
 
         try:
-            domain = get_tenant_domain_model().objects.select_related('tenant').get(domain=hostname_without_port)
-            request.tenant = domain.tenant
+            tenant = domain_index.get_tenant(hostname_without_port)
         except utils.DatabaseError:
             request.urlconf = settings.PUBLIC_SCHEMA_URLCONF
             return
-        except get_tenant_domain_model().DoesNotExist:
+        if tenant is None:
             if hostname_without_port in ("127.0.0.1", "localhost"):
                 request.urlconf = settings.PUBLIC_SCHEMA_URLCONF
                 return
             else:
                 raise Http404
+        request.tenant = tenant
 
         connection.set_tenant(request.tenant)
-        ContentType.objects.clear_cache()
 
         if hasattr(settings, 'PUBLIC_SCHEMA_URLCONF') and request.tenant.schema_name == get_public_schema_name():
             request.urlconf = settings.PUBLIC_SCHEMA_URLCONF